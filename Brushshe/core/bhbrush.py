@@ -2,114 +2,170 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from functools import lru_cache
 
-def bh_draw_line(image_draw, x1, y1, x2, y2, color, size, brush_shape, tool):
-    dx = abs(x2 - x1)
-    dy = abs(y2 - y1)
-    sx = 1 if x1 < x2 else -1
-    sy = 1 if y1 < y2 else -1
-    err = dx - dy
+from PIL import Image, ImageChops, ImageDraw
 
-    if brush_shape == "circle" or tool == "shape":
-        image_draw_shape = image_draw.ellipse
-    elif brush_shape == "square":
-        image_draw_shape = image_draw.rectangle
 
-    while True:
-        # Better variant for pixel compatible.
-        if size <= 1:
-            image_draw.point([x1, y1], fill=color)
-        else:
-            image_draw_shape(
-                [
-                    x1 - (size - 1) // 2,
-                    y1 - (size - 1) // 2,
-                    x1 + size // 2,
-                    y1 + size // 2,
-                ],
-                fill=color,
-                outline=color,
-            )
-
-        if abs(x1 - x2) < 1 and abs(y1 - y2) < 1:
-            break
-
-        e2 = err * 2
-        if e2 > -dy:
-            err -= dy
-            x1 += sx
-        if e2 < dx:
-            err += dx
-            y1 += sy
-
-
-def bh_draw_recoloring_line(image, x1, y1, x2, y2, color_from, color_to, size):
+def bh_line_bbox(x1, y1, x2, y2, size):
+    # Box (left, top, right, bottom) of the line drawn by bh_draw_line or bh_draw_recoloring_line.
     d1 = (size - 1) // 2
     d2 = size // 2
-    # dd = (d2 - d1) / 2
-    max_x = image.width
-    max_y = image.height
-
-    x = x1
-    y = y1
+    return (
+        min(x1, x2) - d1,
+        min(y1, y2) - d1,
+        max(x1, x2) + d2 + 1,
+        max(y1, y2) + d2 + 1,
+    )
+
+
+@lru_cache(maxsize=64)
+def bh_get_dab(brush_shape, size):
+    # Mask of one brush dab of the size x size. It's rasterized once and reused for all lines.
+    # The mask is 1-bit, it's stamped faster than L mode. Don't change the returned image, it's shared.
+    dab = Image.new("1", (size, size), 0)
+    draw = ImageDraw.Draw(dab)
+    if brush_shape == "square":
+        draw.rectangle([0, 0, size - 1, size - 1], fill=1, outline=1)
+    else:
+        draw.ellipse([0, 0, size - 1, size - 1], fill=1, outline=1)
+    return dab
+
+
+@lru_cache(maxsize=16)
+def bh_get_spray_offsets(radius):
+    # All offsets (x, y) of the pixels inside the circle of the spray. Random dots are chosen from them,
+    #   so they are uniform in the circle (as the random points of the square, which are inside the circle).
+    return tuple(
+        (x, y)
+        for y in range(-radius, radius + 1)
+        for x in range(-radius, radius + 1)
+        if x * x + y * y <= radius * radius
+    )
+
+
+def bh_draw_line(image_draw, x1, y1, x2, y2, color, size, brush_shape, tool, spacing=1):
+    # Stamp the dabs of the brush along the line. spacing - the distance between the dabs in pixels,
+    #   with spacing 1 the dab is stamped on each pixel of the line.
     dx = abs(x2 - x1)
     dy = abs(y2 - y1)
     sx = 1 if x1 < x2 else -1
     sy = 1 if y1 < y2 else -1
     err = dx - dy
 
-    # It's for circuit brush, but it work too slow.
-    # ((ii - x - dd) ** 2 + (jj - y - dd) ** 2 < ((d1 + d2 + .5)/2) ** 2
+    if size > 1:
+        dab = bh_get_dab("circle" if tool == "shape" else brush_shape, size)
+        d1 = (size - 1) // 2
 
-    # buffer = set()
-    is_line = False
+    # Distance from the last dab. The first dab is always stamped.
+    distance = spacing
 
     while True:
-        if size <= 1:
-            if x >= 0 and x < max_x and y >= 0 and y < max_y and image.getpixel((x, y)) == color_from:
-                image.putpixel((int(x), int(y)), color_to)
-        else:
-            if is_line is False:
-                for ii in range(int(x - d1), int(x + d2 + 1)):
-                    for jj in range(int(y - d1), int(y + d2 + 1)):
-                        if ii >= 0 and ii < max_x and jj >= 0 and jj < max_y and image.getpixel((ii, jj)) == color_from:
-                            image.putpixel((ii, jj), color_to)
-                            # buffer.add((ii, jj))
+        is_last = abs(x1 - x2) < 1 and abs(y1 - y2) < 1
+
+        if distance >= spacing or is_last:
+            distance = 0
+            # Better variant for pixel compatible.
+            if size <= 1:
+                image_draw.point([x1, y1], fill=color)
             else:
-                # Now we can check firsts or lasts lines only.
-
-                # Checking horizontal movement.
-                if sx > 0:
-                    ii = int(x + d2)
-                else:
-                    ii = int(x - d1)
-
-                for jj in range(int(y - d1), int(y + d2 + 1)):
-                    if ii >= 0 and ii < max_x and jj >= 0 and jj < max_y and image.getpixel((ii, jj)) == color_from:
-                        image.putpixel((ii, jj), color_to)
-                        # buffer.add((ii, jj))
-
-                # Checking vertical movement.
-                if sy > 0:
-                    jj = int(y + d2)
-                else:
-                    jj = int(y - d1)
-
-                for ii in range(int(x - d1), int(x + d2 + 1)):
-                    if ii >= 0 and ii < max_x and jj >= 0 and jj < max_y and image.getpixel((ii, jj)) == color_from:
-                        image.putpixel((ii, jj), color_to)
-                        # buffer.add((ii, jj))
-
-        if abs(x - x2) < 1 and abs(y - y2) < 1:
-            # self.draw.point([*buffer], fill=color)
+                image_draw.bitmap((x1 - d1, y1 - d1), dab, fill=color)
+
+        if is_last:
             break
 
         e2 = err * 2
+        step = 0
         if e2 > -dy:
             err -= dy
-            x += sx
+            x1 += sx
+            step += 1
         if e2 < dx:
             err += dx
-            y += sy
+            y1 += sy
+            step += 1
+        distance += 1 if step == 1 else 1.4142135623730951
+
+
+def bh_draw_recoloring_line(image, x1, y1, x2, y2, color_from, color_to, size, brush_shape="square"):
+    # Replace color_from by color_to under the line of the brush. The footprint of the whole line is drawn
+    #   once, and the pixels of color_from are found in its box by one compare.
+    if image.mode not in ("L", "RGB", "RGBA"):
+        return
+
+    bx1, by1, bx2, by2 = bh_line_bbox(x1, y1, x2, y2, size)
+    bx1 = max(0, bx1)
+    by1 = max(0, by1)
+    bx2 = min(image.width, bx2)
+    by2 = min(image.height, by2)
+    if bx1 >= bx2 or by1 >= by2:
+        return
+
+    footprint = Image.new("L", (bx2 - bx1, by2 - by1), 0)
+    bh_draw_line(ImageDraw.Draw(footprint), x1 - bx1, y1 - by1, x2 - bx1, y2 - by1, 255, size, brush_shape, None)
+
+    region = image.crop((bx1, by1, bx2, by2))
+    diff = ImageChops.difference(region, Image.new(image.mode, region.size, color_from))
+    if image.mode != "L":
+        # Max of the bands: 0 only for the same color.
+        bands = diff.split()
+        diff = bands[0]
+        for band in bands[1:]:
+            diff = ImageChops.lighter(diff, band)
+
+    # 255 for the same color under the footprint.
+    mask = ImageChops.multiply(diff.point([255] + [0] * 255), footprint)
+    image.paste(color_to, (bx1, by1), mask)
+
+
+def bh_segment_bbox(x1, y1, x2, y2, size):
+    # Box of bh_draw_segment. The wide line of the even size can be 1 px out of the dabs.
+    left, top, right, bottom = bh_line_bbox(x1, y1, x2, y2, size)
+    return left - 1, top - 1, right + 1, bottom + 1
+
+
+def bh_draw_segment(image_draw, x1, y1, x2, y2, color, size, brush_shape):
+    # Almost the same figure as bh_draw_line with spacing 1 (the union of the dabs), but it's filled in one pass:
+    #   the capsule (the wide line with the round caps) or the hull of the two squares. The edges are straight,
+    #   without the steps of the dabs along the line.
+    if size < 16:
+        # Small dabs are cheap, and their union differs from the capsule too much.
+        bh_draw_line(image_draw, x1, y1, x2, y2, color, size, brush_shape, None)
+        return
+
+    d1 = (size - 1) // 2
+    d2 = size // 2
 
-        is_line = True
+    if brush_shape == "square":
+        corners = [(x + dx, y + dy) for x, y in ((x1, y1), (x2, y2)) for dx in (-d1, d2) for dy in (-d1, d2)]
+        image_draw.polygon(_convex_hull(corners), fill=color, outline=color)
+        return
+
+    image_draw.ellipse([x1 - d1, y1 - d1, x1 + d2, y1 + d2], fill=color, outline=color)
+    if (x1, y1) != (x2, y2):
+        image_draw.ellipse([x2 - d1, y2 - d1, x2 + d2, y2 + d2], fill=color, outline=color)
+        # The center of the dab with the even size is between the pixels.
+        c = (d2 - d1) / 2
+        image_draw.line([x1 + c, y1 + c, x2 + c, y2 + c], fill=color, width=size)
+
+
+def _convex_hull(points):
+    # Monotone chain. Return the points of the hull in order.
+    points = sorted(set(points))
+    if len(points) <= 2:
+        return points
+
+    def half(points):
+        hull = []
+        for p in points:
+            while len(hull) >= 2:
+                (ax, ay), (bx, by) = hull[-2], hull[-1]
+                if (bx - ax) * (p[1] - ay) - (by - ay) * (p[0] - ax) > 0:
+                    break
+                hull.pop()
+            hull.append(p)
+        return hull
+
+    lower = half(points)
+    upper = half(reversed(points))
+    return lower[:-1] + upper[:-1]
@@ -2,8 +2,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-# import math
-from PIL import Image, ImageChops, ImageDraw, ImageFilter
+import math
+import queue
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageChops, ImageDraw
 
 
 class BhComposer:
@@ -23,30 +27,54 @@ class BhComposer:
         self.background_color_2 = "#D0D0D0"
         self.background_size = 256
         self.background_tile_size = 16
-        self.ants_tile_size = 16
         self.mask_type = 0
         self.background_tile_image = self.generate_tile_image()
-        self.ants_tile_image = self.generate_ants_image()
 
-        self.l_image = None
+        self.l_image = None  # Full size picture.
         self.background_image = None
-
-        self.ants_image = None
-        self.ants_position = 0
-        self.ants_position_update = False
-
-        self.mask_img = None  # Must be gray image (L mode)
-        self.tails_area = None
-
-        self.cache_mask_img = None
-        self.cache_tails_area = None
-        self.force_update_mask = False
-
-    def inc_ants_position(self):
-        self.ants_position += 4
-        if self.ants_position >= 15:
-            self.ants_position = 0
-        self.ants_position_update = True
+        self.zoom = 1
+
+        self.mask_img = None  # Must be gray image (L mode). Full size.
+
+        # Stroke, which is painted now (BhStrokeBuffer). It's drawn over the picture through the mask.
+        self.stroke = None
+
+        # Changed on any change of the mask, so the outline of the selection can be updated.
+        self.mask_generation = 0
+
+        # Last composed frame. The frame area is in canvas coordinates (x1, y1, x2, y2).
+        self.compose_image = None
+        self.frame_area = None
+        self.frame_is_valid = False
+        self.frame_zoom = None
+        self.frame_picture_size = None
+
+        # Changed parts of the picture (left, top, right, bottom) since the last compose.
+        self.dirty_rects = []
+
+        # Cache of the composed tiles (canvas coordinates). Key: (tile x, tile y, zoom, document generation,
+        #   tile generation). Tile generation is the sum of the generations of the picture cells under the tile,
+        #   so any edit under the tile changes the key.
+        self.tile_size = 128
+        self.tiles_cache = OrderedDict()
+        self.tiles_cache_size = 0  # In bytes.
+        self.tiles_cache_limit = 64 * 1024 * 1024  # In bytes.
+        self.document_generation = 0
+        self.cells_generations = {}
+        self.cell_size = 256  # Picture pixels.
+        self.background_tile_crop = None
+
+        # Mip pyramids for zoom < 1. Level k is the picture (mask) reduced by 2^k, level 0 is the source.
+        #   Levels are built on demand and updated only inside the changed parts of the picture.
+        self.mip_levels = {"image": [], "mask": []}
+        self.mip_dirty_rects = []
+
+        # Tiles are composed in the render thread, if it is started. Else they are composed right away.
+        #   The layers of the tile are cut on the main thread, so the thread doesn't touch the picture.
+        self.render_thread = None
+        self.render_jobs = queue.Queue()
+        self.render_results = queue.Queue()
+        self.pending_tiles = {}  # (tile x, tile y): key of the last requested tile.
 
     def generate_tile_image(self):
         image_bg = Image.new("RGB", (self.background_size, self.background_size), self.background_color_1)
@@ -70,24 +98,6 @@ class BhComposer:
 
         return image_bg
 
-    def generate_ants_image(self):
-        white = 255
-
-        image_bg = Image.new("L", (self.background_size, self.background_size), 0)
-        image_ants = Image.new("L", (self.ants_tile_size, self.ants_tile_size), 0)
-        draw_ants = ImageDraw.Draw(image_ants)
-
-        draw_ants.line((-2, 18, 18, -2), fill=white, width=6)
-        draw_ants.line((-6, 6, 6, -6), fill=white, width=6)
-        draw_ants.line((10, 22, 22, 10), fill=white, width=6)
-
-        dr = self.background_size // self.ants_tile_size
-        for i_ in range(0, dr):
-            for j_ in range(0, dr):
-                image_bg.paste(image_ants, (i_ * self.ants_tile_size, j_ * self.ants_tile_size))
-
-        return image_bg
-
     def get_background_tile_image(self):
         return self.background_tile_image
 
@@ -95,108 +105,490 @@ class BhComposer:
         return self.background_size
 
     def set_l_image(self, image: Image):
-        self.l_image = image
-        self.width = image.width
-        self.height = image.height
-
-    def set_mask_image(self, image: Image, tails_area: tuple[4] | None):
-        self.mask_img = image  # After cut and resize.
-        self.tails_area = tails_area
+        if image is not self.l_image or image.width != self.width or image.height != self.height:
+            self.l_image = image
+            self.width = image.width
+            self.height = image.height
+            self.invalidate()
+
+    def set_mask_image(self, image: Image):
+        if image is not self.mask_img:
+            self.mask_img = image
+            self.mask_generation += 1
+            self.invalidate()
+
+    def set_stroke(self, stroke):
+        # The changed parts must be added as the dirty rects.
+        self.stroke = stroke
+
+    def set_zoom(self, zoom):
+        if zoom != self.zoom:
+            self.frame_is_valid = False
+        self.zoom = zoom
 
     def set_force_update_mask(self):
-        self.force_update_mask = True
-
-    def get_current_ants_image(self, w, h):
-        if (
-            self.ants_position_update is True
-            or self.ants_image is None
-            or w != self.ants_image.width
-            or h != self.ants_image.height
-        ):
-            self.ants_image = Image.new("RGB", (w, h), 0)
-            self.ants_position_update = False
-
-            for i_ in range(0, w, self.background_size):
-                for j_ in range(0, h - 1, self.background_size):
-                    self.ants_image.paste(self.ants_tile_image, (i_ - self.ants_position, j_))
-
-        return self.ants_image
-
-    def get_compose_image(self, x1, y1, x2, y2):
-        if self.l_image is None:
+        self.mask_generation += 1
+        self.invalidate()
+
+    def set_cache_limit(self, limit: int):
+        # Limit in bytes.
+        self.tiles_cache_limit = limit
+        self.trim_tiles_cache()
+
+    def invalidate(self):
+        # All picture can be changed. Forget all composed tiles.
+        self.document_generation += 1
+        self.cells_generations = {}
+        self.tiles_cache.clear()
+        self.tiles_cache_size = 0
+        self.frame_is_valid = False
+        self.dirty_rects = []
+        self.mip_levels = {"image": [], "mask": []}
+        self.mip_dirty_rects = []
+        self.pending_tiles = {}
+
+    def start_render_thread(self):
+        if self.render_thread is None:
+            self.render_thread = threading.Thread(target=self.render_loop, daemon=True)
+            self.render_thread.start()
+
+    def render_loop(self):
+        while True:
+            key, layer_image, layer_mask, w, h = self.render_jobs.get()
+            if self.pending_tiles.get(key[:2]) != key:
+                continue  # The tile was changed again or forgotten, skip the outdated job.
+            self.render_results.put((key, self.compose_tile_layers(layer_image, layer_mask, w, h)))
+
+    def has_pending_tiles(self, box: tuple[4] | None = None):
+        # box - the part of the picture (left, top, right, bottom), None - the whole picture.
+        if box is None:
+            return len(self.pending_tiles) > 0
+        x1, y1, x2, y2 = self.image_box_to_canvas_area(box)
+        ts = self.tile_size
+        return any(x1 // ts <= tx <= x2 // ts and y1 // ts <= ty <= y2 // ts for tx, ty in self.pending_tiles)
+
+    def add_dirty_rect(self, rect: tuple[4]):
+        # Tools report changed parts of the picture here. Overlapped rects are merged to one.
+        x1, y1, x2, y2 = rect
+        x1 = max(0, int(x1))
+        y1 = max(0, int(y1))
+        x2 = min(self.width, int(x2))
+        y2 = min(self.height, int(y2))
+        if x1 >= x2 or y1 >= y2:
             return
 
-        if x1 is None:
-            x1 = 0
-        if y1 is None:
-            y1 = 0
-        if x2 is None:
-            x2 = self.width - 1
-        if y2 is None:
-            y2 = self.height - 1
+        for cx in range(x1 // self.cell_size, (x2 - 1) // self.cell_size + 1):
+            for cy in range(y1 // self.cell_size, (y2 - 1) // self.cell_size + 1):
+                self.cells_generations[(cx, cy)] = self.cells_generations.get((cx, cy), 0) + 1
 
-        w = x2 - x1 + 1
-        h = y2 - y1 + 1
+        if any(len(levels) > 1 for levels in self.mip_levels.values()):
+            self.mip_dirty_rects.append((x1, y1, x2, y2))
 
+        merged = []
+        for r in self.dirty_rects:
+            if r[0] <= x2 and x1 <= r[2] and r[1] <= y2 and y1 <= r[3]:
+                x1, y1, x2, y2 = min(x1, r[0]), min(y1, r[1]), max(x2, r[2]), max(y2, r[3])
+            else:
+                merged.append(r)
+        merged.append((x1, y1, x2, y2))
+        self.dirty_rects = merged
+
+    def has_dirty_rects(self):
+        return len(self.dirty_rects) > 0
+
+    def can_compose_dirty(self, x1, y1, x2, y2):
+        # The dirty rects can be composed only on top of an actual frame for the same canvas area.
+        return self.frame_is_valid is True and self.compose_image is not None and self.frame_area == (x1, y1, x2, y2)
+
+    def can_compose_shifted(self, x1, y1, x2, y2):
+        # The frame can be moved to the new canvas area of the same size, if they are overlapped.
+        if self.frame_is_valid is False or self.compose_image is None or self.frame_area == (x1, y1, x2, y2):
+            return False
+        ox1, oy1, ox2, oy2 = self.frame_area
+        if ox2 - ox1 != x2 - x1 or oy2 - oy1 != y2 - y1:
+            return False
+        return max(x1, ox1) <= min(x2, ox2) and max(y1, oy1) <= min(y2, oy2)
+
+    def get_zoom_divider(self):
+        # For zoom < 1 the zoom is always 1 / 2^n, so one canvas pixel is the n x n box of the picture.
+        return round(1 / self.zoom)
+
+    def get_canvas_size(self):
+        return int(self.width * self.zoom), int(self.height * self.zoom)
+
+    def canvas_to_image_box(self, x1, y1, x2, y2):
+        # Canvas area (x1, y1, x2, y2) to the picture box (left, top, right, bottom).
+        if self.zoom < 1:
+            n = self.get_zoom_divider()
+            box = (x1 * n, y1 * n, (x2 + 1) * n, (y2 + 1) * n)
+        else:
+            box = (
+                math.floor(x1 / self.zoom),
+                math.floor(y1 / self.zoom),
+                math.floor(x2 / self.zoom) + 1,
+                math.floor(y2 / self.zoom) + 1,
+            )
+        return (
+            max(0, box[0]),
+            max(0, box[1]),
+            min(self.width, box[2]),
+            min(self.height, box[3]),
+        )
+
+    def image_box_to_canvas_area(self, box: tuple[4]):
+        # Picture box (left, top, right, bottom) to the canvas area (x1, y1, x2, y2) which shows it.
+        if self.zoom < 1:
+            n = self.get_zoom_divider()
+            return box[0] // n, box[1] // n, math.ceil(box[2] / n) - 1, math.ceil(box[3] / n) - 1
+        return (
+            math.floor(box[0] * self.zoom),
+            math.floor(box[1] * self.zoom),
+            math.ceil(box[2] * self.zoom) - 1,
+            math.ceil(box[3] * self.zoom) - 1,
+        )
+
+    def update_mip_levels(self):
+        # Rebuild the built levels only inside the changed parts of the picture.
+        # Each level is made from the previous one, the box is aligned to 2 on the previous level,
+        #   so the updated part has the same pixels as the fully reduced level.
+        for rect in self.mip_dirty_rects:
+            for levels in self.mip_levels.values():
+                for k in range(1, len(levels)):
+                    d = 2**k
+                    bx1 = rect[0] // d
+                    by1 = rect[1] // d
+                    bx2 = math.ceil(rect[2] / d)
+                    by2 = math.ceil(rect[3] / d)
+                    prev = levels[k - 1]
+                    src_box = (bx1 * 2, by1 * 2, min(bx2 * 2, prev.width), min(by2 * 2, prev.height))
+                    levels[k].paste(prev.crop(src_box).reduce(2), (bx1, by1))
+        self.mip_dirty_rects = []
+
+    def get_mip_level(self, name, source, level):
+        # name - "image" or "mask", source - the full size image for level 0.
+        self.update_mip_levels()
+
+        levels = self.mip_levels[name]
+        if len(levels) == 0 or levels[0] is not source:
+            levels = [source]
+            self.mip_levels[name] = levels
+
+        while len(levels) <= level:
+            levels.append(levels[-1].reduce(2))
+
+        return levels[level]
+
+    def get_layer_images(self, x1, y1, x2, y2, with_mask=True):
+        # Cut the part of the picture (and mask) under the canvas area (x1, y1, x2, y2) and scale it to the canvas.
+        if self.zoom < 1 and self.l_image.mode not in ("1", "P"):
+            # Zoom is 1 / 2^level, so the canvas area is the same area of the mip level.
+            level = round(math.log2(self.get_zoom_divider()))
+            box = (x1, y1, x2 + 1, y2 + 1)
+            image_box = self.canvas_to_image_box(x1, y1, x2, y2)
+            if self.stroke is not None and self.stroke.intersects(image_box):
+                # Reduced by the same steps as the mip levels, so the pixels are the same without the stroke.
+                image = self.l_image.crop(image_box)
+                self.stroke.apply(image, image_box, self.mask_img)
+                for _ in range(level):
+                    image = image.reduce(2)
+                image = image.crop((0, 0, x2 - x1 + 1, y2 - y1 + 1))
+            else:
+                image = self.get_mip_level("image", self.l_image, level).crop(box)
+            mask = None
+            if self.mask_img is not None and with_mask is True:
+                mask = self.get_mip_level("mask", self.mask_img, level).crop(box)
+            return image, mask
+
+        box = self.canvas_to_image_box(x1, y1, x2, y2)
+        tmp_image = self.l_image.crop(box)
+        if self.stroke is not None:
+            self.stroke.apply(tmp_image, box, self.mask_img)
+        tmp_mask = None if self.mask_img is None or with_mask is False else self.mask_img.crop(box)
+
+        if self.zoom < 1:
+            n = self.get_zoom_divider()
+            # https://pillow.readthedocs.io/en/stable/handbook/concepts.html#concept-filters
+            # Reduce is the BOX filter with the integer factor, so any aligned part gives the same pixels.
+            if tmp_image.mode in ("1", "P"):
+                # Palette images can't be averaged.
+                size = (math.ceil(tmp_image.width / n), math.ceil(tmp_image.height / n))
+                image = tmp_image.resize(size, Image.NEAREST)
+            else:
+                image = tmp_image.reduce(n)
+            mask = None if tmp_mask is None else tmp_mask.reduce(n)
+            return image, mask
+
+        r_w = max(1, math.floor(tmp_image.width * self.zoom))
+        r_h = max(1, math.floor(tmp_image.height * self.zoom))
+        image = tmp_image.resize((r_w, r_h), Image.NEAREST)
+        mask = None if tmp_mask is None else tmp_mask.resize((r_w, r_h), Image.NEAREST)
+
+        # Subpixel correct: the area can begin not from the first pixel of the picture.
+        dx = x1 - math.floor(box[0] * self.zoom)
+        dy = y1 - math.floor(box[1] * self.zoom)
+        if dx != 0 or dy != 0:
+            w = x2 - x1 + 1
+            h = y2 - y1 + 1
+            image = image.crop((dx, dy, dx + w, dy + h))
+            mask = None if mask is None else mask.crop((dx, dy, dx + w, dy + h))
+
+        return image, mask
+
+    def get_mask_image(self, mask_image, w, h):
+        tmp_mask_img = mask_image
+
+        if tmp_mask_img.mode != "L":
+            tmp_mask_img = tmp_mask_img.convert("L")
+
+        if tmp_mask_img.width != w or tmp_mask_img.height != h:
+            tmp_mask_img = tmp_mask_img.crop((0, 0, w, h))
+
+        # Not selected part is filled. The ants (mask_type 1) are drawn as canvas lines, not here.
+        tmp_mask_img2 = ImageChops.invert(tmp_mask_img)
+        tmp_mask_img3 = ImageChops.multiply(tmp_mask_img2, Image.new("L", (w, h), 128))
+        tmp_image = Image.new("RGBA", (w, h), (255, 0, 0, 127))
+        tmp_image.putalpha(tmp_mask_img3)
+
+        return tmp_image
+
+    def get_tile_area(self, tx, ty):
+        cw, ch = self.get_canvas_size()
+        x1 = tx * self.tile_size
+        y1 = ty * self.tile_size
+        x2 = min(x1 + self.tile_size, cw) - 1
+        y2 = min(y1 + self.tile_size, ch) - 1
+        return x1, y1, x2, y2
+
+    def get_tile_generation(self, tile_area: tuple[4]):
+        box = self.canvas_to_image_box(*tile_area)
+        generation = 0
+        for cx in range(box[0] // self.cell_size, (box[2] - 1) // self.cell_size + 1):
+            for cy in range(box[1] // self.cell_size, (box[3] - 1) // self.cell_size + 1):
+                generation += self.cells_generations.get((cx, cy), 0)
+        return generation
+
+    def get_tile_key(self, tx, ty):
+        tile_area = self.get_tile_area(tx, ty)
+        return tile_area, (tx, ty, self.zoom, self.document_generation, self.get_tile_generation(tile_area))
+
+    def get_tile_image(self, tx, ty, sync=False):
+        # Return the composed tile. If the render thread is started, the tile is requested from it
+        #   and None is returned until the tile is ready.
+        # sync - compose the tile here, if it is not ready (the result of the thread for it is dropped).
+        tile_area, key = self.get_tile_key(tx, ty)
+
+        tile_image = self.tiles_cache.get(key)
+        if tile_image is not None:
+            self.tiles_cache.move_to_end(key)
+            return tile_image
+
+        if self.render_thread is None or sync:
+            tile_image = self.compose_tile(*tile_area)
+            self.add_cached_tile(key, tile_image)
+            self.pending_tiles.pop((tx, ty), None)
+            return tile_image
+
+        if self.pending_tiles.get((tx, ty)) != key:
+            self.pending_tiles[(tx, ty)] = key
+            x1, y1, x2, y2 = tile_area
+            layer_image, layer_mask = self.get_layer_images(x1, y1, x2, y2, with_mask=self.mask_type == 0)
+            self.get_background_image()
+            self.render_jobs.put((key, layer_image, layer_mask, x2 - x1 + 1, y2 - y1 + 1))
+
+        return None
+
+    def add_cached_tile(self, key, tile_image):
+        self.tiles_cache[key] = tile_image
+        self.tiles_cache_size += tile_image.width * tile_image.height * 3
+        self.trim_tiles_cache()
+
+    def trim_tiles_cache(self):
+        while self.tiles_cache_size > self.tiles_cache_limit and len(self.tiles_cache) > 0:
+            _, tile_image = self.tiles_cache.popitem(last=False)
+            self.tiles_cache_size -= tile_image.width * tile_image.height * 3
+
+    def get_background_image(self):
         # Background image MUST be RGB (without alpha) for optimization on tk (and ctk).
-        if self.background_image is None or w != self.background_image.width or h != self.background_image.height:
-            self.background_image = Image.new("RGB", (w, h), self.background_color_1)
-            for i_ in range(0, w - 1, self.background_size):
-                for j_ in range(0, h - 1, self.background_size):
+        # Tiles begin on the multiple of the background cell, so the background is the same for all tiles.
+        if self.background_image is None or self.background_image.size != (self.tile_size, self.tile_size):
+            self.background_image = Image.new("RGB", (self.tile_size, self.tile_size), self.background_color_1)
+            for i_ in range(0, self.tile_size, self.background_size):
+                for j_ in range(0, self.tile_size, self.background_size):
                     self.background_image.paste(self.background_tile_image, (i_, j_))
+        return self.background_image
 
-        image = self.background_image.copy()
+    def compose_tile(self, x1, y1, x2, y2):
+        layer_image, layer_mask = self.get_layer_images(x1, y1, x2, y2, with_mask=self.mask_type == 0)
+        return self.compose_tile_layers(layer_image, layer_mask, x2 - x1 + 1, y2 - y1 + 1)
 
-        if self.l_image.mode == "RGBA":
-            image.paste(self.l_image, (0, 0), self.l_image)
+    def compose_tile_layers(self, layer_image, layer_mask, w, h):
+        # Can be called from the render thread: use only the given layers and the background.
+        background_image = self.get_background_image()
+        if w == self.tile_size and h == self.tile_size:
+            image = background_image.copy()
         else:
-            image.paste(self.l_image, (0, 0))
-
-        if self.mask_img is not None:
-            if (
-                self.tails_area != self.cache_tails_area
-                or self.cache_mask_img is None
-                or self.cache_mask_img.width != w
-                or self.cache_mask_img.height != h
-                or self.force_update_mask is True
-            ):
-                # print("Debug: Force update mask", self.tails_area)
-
-                tmp_mask_img = self.mask_img.copy()
+            image = background_image.crop((0, 0, w, h))
 
-                self.cache_tails_area = self.tails_area
-                self.force_update_mask = False
+        if layer_image.mode == "RGBA":
+            image.paste(layer_image, (0, 0), layer_image)
+        else:
+            image.paste(layer_image, (0, 0))
 
-                if tmp_mask_img.mode != "L":
-                    tmp_mask_img.convert("L")
+        if layer_mask is not None:
+            mask_image = self.get_mask_image(layer_mask, w, h)
+            image.paste(mask_image, (0, 0), mask_image)
 
-                if self.mask_type == 0:
-                    tmp_mask_img2 = ImageChops.invert(tmp_mask_img)
-                    tmp_mask_img3 = ImageChops.multiply(tmp_mask_img2, Image.new("L", (w, h), 128))
-                    tmp_image = Image.new("RGBA", (w, h), (255, 0, 0, 127))
-                    tmp_image.putalpha(tmp_mask_img3)
+        return image
 
-                    self.cache_mask_img = tmp_image
+    def get_compose_image(self, x1, y1, x2, y2):
+        # Compose the frame for the canvas area (x1, y1, x2, y2). The area must begin from a tile.
+        # The not ready tiles are requested from the render thread, and the last frame (moved and scaled to
+        #   the new area) is shown instead of them until they come. Without it they are composed here.
+        if self.l_image is None:
+            return
 
-                    # image.paste(tmp_image, (0, 0), tmp_image)
-                else:
-                    tmp_image = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-                    tmp_mask_img2 = ImageChops.invert(tmp_mask_img).filter(ImageFilter.CONTOUR)
-                    tmp_mask_img3 = ImageChops.invert(tmp_mask_img2)
+        w = x2 - x1 + 1
+        h = y2 - y1 + 1
 
-                    tmp_image.paste(tmp_mask_img2, (0, 0), tmp_mask_img3)
+        previous_image = self.get_previous_frame_image(x1, y1, x2, y2)
+        if previous_image is not None:
+            image = previous_image
+        else:
+            image = Image.new("RGB", (w, h), self.background_color_1)
 
-                    self.cache_mask_img = tmp_image
+        for tx in range(x1 // self.tile_size, x2 // self.tile_size + 1):
+            for ty in range(y1 // self.tile_size, y2 // self.tile_size + 1):
+                tile_image = self.get_tile_image(tx, ty, sync=previous_image is None)
+                if tile_image is not None:
+                    image.paste(tile_image, (tx * self.tile_size - x1, ty * self.tile_size - y1))
 
-                    # tmp_image_3 = tmp_image.convert("L")
-                    # tmp_image_2 = ImageChops.add(tmp_image_3, self.get_current_ants_image(w, h))
-                    # image.paste(tmp_image_2, (0, 0), tmp_image)
+        self.compose_image = image
+        self.frame_area = (x1, y1, x2, y2)
+        self.frame_zoom = self.zoom
+        self.frame_picture_size = (self.width, self.height)
+        self.frame_is_valid = True
+        self.dirty_rects = []
 
-            if self.mask_type == 0:
-                image.paste(self.cache_mask_img, (0, 0), self.cache_mask_img)
-            else:
-                tmp_image = self.cache_mask_img.convert("RGB")
-                tmp_image_2 = ImageChops.add(tmp_image, self.get_current_ants_image(w, h))
-                image.paste(tmp_image_2, (0, 0), self.cache_mask_img)
+        return image
 
+    def get_previous_frame_image(self, x1, y1, x2, y2):
+        # The last frame of the same picture size, moved and scaled to the canvas area (x1, y1, x2, y2).
+        # Return None, if there is no frame or it doesn't overlap the area.
+        if self.compose_image is None or self.frame_picture_size != (self.width, self.height):
+            return None
+
+        # Canvas coordinates of the last frame per the canvas coordinates of the new one.
+        scale = self.frame_zoom / self.zoom
+        ox1, oy1 = self.frame_area[:2]
+        fw, fh = self.compose_image.size
+
+        # Part of the last frame, which is shown in the area.
+        left = max(0.0, x1 * scale - ox1)
+        top = max(0.0, y1 * scale - oy1)
+        right = min(float(fw), (x2 + 1) * scale - ox1)
+        bottom = min(float(fh), (y2 + 1) * scale - oy1)
+        if left >= right or top >= bottom:
+            return None
+
+        # Its position and size on the new frame.
+        px1 = round((left + ox1) / scale) - x1
+        py1 = round((top + oy1) / scale) - y1
+        px2 = round((right + ox1) / scale) - x1
+        py2 = round((bottom + oy1) / scale) - y1
+        if px1 >= px2 or py1 >= py2:
+            return None
+
+        image = Image.new("RGB", (x2 - x1 + 1, y2 - y1 + 1), self.background_color_1)
+        part = self.compose_image.resize((px2 - px1, py2 - py1), Image.NEAREST, box=(left, top, right, bottom))
+        image.paste(part, (px1, py1))
         return image
+
+    def get_frame_position(self):
+        # Position of the frame on the canvas.
+        return self.frame_area[0], self.frame_area[1]
+
+    def get_shifted_compose_images(self, x1, y1, x2, y2):
+        # Move the last frame to the new canvas area (x1, y1, x2, y2) and compose only the new tiles.
+        # Return (box, position, parts): the overlapped box of the old frame, its position on the new frame
+        #   and the list of (image, x, y) for the new tiles.
+        ox1, oy1, ox2, oy2 = self.frame_area
+        ix1, iy1, ix2, iy2 = max(x1, ox1), max(y1, oy1), min(x2, ox2), min(y2, oy2)
+        box = (ix1 - ox1, iy1 - oy1, ix2 - ox1 + 1, iy2 - oy1 + 1)
+        position = (ix1 - x1, iy1 - y1)
+
+        image = Image.new("RGB", self.compose_image.size, self.background_color_1)
+        image.paste(self.compose_image.crop(box), position)
+
+        parts = []
+        for tx in range(x1 // self.tile_size, x2 // self.tile_size + 1):
+            for ty in range(y1 // self.tile_size, y2 // self.tile_size + 1):
+                tx1, ty1, tx2, ty2 = self.get_tile_area(tx, ty)
+                if ix1 <= tx1 and iy1 <= ty1 and tx2 <= ix2 and ty2 <= iy2:
+                    continue
+                tile_image = self.get_tile_image(tx, ty)
+                if tile_image is None:
+                    tile_image = self.get_background_image().crop((0, 0, tx2 - tx1 + 1, ty2 - ty1 + 1))
+                x = tx1 - x1
+                y = ty1 - y1
+                image.paste(tile_image, (x, y))
+                parts.append((tile_image, x, y))
+
+        self.compose_image = image
+        self.frame_area = (x1, y1, x2, y2)
+        self.frame_zoom = self.zoom
+        self.frame_picture_size = (self.width, self.height)
+
+        return box, position, parts
+
+    def get_dirty_compose_images(self):
+        # Recompose only the tiles under the dirty parts of the last frame.
+        # Return list of (image, x, y), where x, y - position of the part on the frame.
+        result = []
+
+        x1, y1, x2, y2 = self.frame_area
+
+        tiles = set()
+        for rect in self.dirty_rects:
+            area = self.image_box_to_canvas_area(rect)
+            for tx in range(max(x1, area[0]) // self.tile_size, min(x2, area[2]) // self.tile_size + 1):
+                for ty in range(max(y1, area[1]) // self.tile_size, min(y2, area[3]) // self.tile_size + 1):
+                    tiles.add((tx, ty))
+
+        for tx, ty in sorted(tiles):
+            image = self.get_tile_image(tx, ty)
+            if image is not None:
+                result.append(self.put_tile_on_frame(tx, ty, image))
+
+        self.dirty_rects = []
+
+        return result
+
+    def get_ready_compose_images(self):
+        # Take the tiles composed by the render thread. Return list of (image, x, y) for the tiles of the frame.
+        result = []
+
+        while True:
+            try:
+                key, image = self.render_results.get_nowait()
+            except queue.Empty:
+                break
+
+            tx, ty = key[:2]
+            if self.pending_tiles.get((tx, ty)) != key:
+                continue  # Outdated.
+            del self.pending_tiles[(tx, ty)]
+            self.add_cached_tile(key, image)
+
+            if self.frame_is_valid is True and key[2] == self.zoom:
+                x1, y1, x2, y2 = self.frame_area
+                if x1 <= tx * self.tile_size <= x2 and y1 <= ty * self.tile_size <= y2:
+                    result.append(self.put_tile_on_frame(tx, ty, image))
+
+        return result
+
+    def put_tile_on_frame(self, tx, ty, image):
+        x = tx * self.tile_size - self.frame_area[0]
+        y = ty * self.tile_size - self.frame_area[1]
+
+        self.compose_image.paste(image, (x, y))
+        return image, x, y
@@ -3,6 +3,9 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import math
+from collections import deque
+from functools import lru_cache
+from itertools import islice
 
 
 class BhPoint:
@@ -11,34 +14,63 @@ class BhPoint:
         x: float,
         y: float,
         pressure: float = 1,
+        time: float | None = None,
         *args,
         **kwargs,
     ):
         self.x = x
         self.y = y
         self.pressure = pressure
+        self.time = time  # In ms, for example the time of the event.
 
-        # Will need in future.
+        # Set by BhHistory.add_point from the previous point.
+        self.distance = 0.0
+        self.velocity = 0.0  # Pixels per ms, 0 without the time.
+        self.direction = 0.0  # Angle in radians.
 
-        # self.distance = 0
-        # self.velocity = 0
-        # self.direction = 0
+
+@lru_cache(maxsize=32)
+def _get_smoothing_weights(smoothing_quality, smoothing_factor):
+    # Gaussian weights of the last points (the last point is the first). They depend only on the settings,
+    #   so they are computed once.
+    # The distance between the points is taken as constant (velocity 0.01 * 100 for each point).
+    gaussian_weight_sqr = smoothing_factor * smoothing_factor
+    if gaussian_weight_sqr == 0.0:
+        return ()
+
+    gaussian_weight = 1 / (math.sqrt(2 * math.pi) * smoothing_factor)
+    weights = []
+    velocity_sum = 0.0
+    for _ in range(max(0, smoothing_quality - 1)):
+        velocity_sum += 0.01 * 100
+        weights.append(gaussian_weight * math.exp(-velocity_sum * velocity_sum / (2 * gaussian_weight_sqr)))
+    return tuple(weights)
 
 
 class BhHistory:
     def __init__(self, limit_length: int = 256):
         max_length = 256
-        self.history = []
         self.limit_length = limit_length
         if self.limit_length > max_length:
             self.limit_length = max_length
+        # Ring buffer: the oldest point is dropped when the new one is added.
+        self.history = deque(maxlen=self.limit_length)
 
     def add_point(self, point: BhPoint):
-        if len(self.history) < self.limit_length:
-            self.history.append(point)
-        else:
-            del self.history[0]
-            self.history.append(point)
+        if len(self.history) > 0:
+            prev = self.history[-1]
+            dx = point.x - prev.x
+            dy = point.y - prev.y
+            point.distance = math.hypot(dx, dy)
+            if point.distance > 0:
+                point.direction = math.atan2(dy, dx)
+            else:
+                point.direction = prev.direction
+            if point.time is not None and prev.time is not None and point.time > prev.time:
+                point.velocity = point.distance / (point.time - prev.time)
+            else:
+                point.velocity = prev.velocity
+        self.history.append(point)
 
     def get_history(self):
         return self.history
@@ -49,9 +81,9 @@ class BhHistory:
     def get_last_points(self, count):
         ll = self.get_history_length()
         if count <= ll:
-            return self.history[ll - count : ll - 1]
+            return list(islice(self.history, ll - count, ll - 1))
         else:
-            return self.history
+            return list(self.history)
 
     def get_smoothing_point(self, smoothing_quality, smoothing_factor):
         ll = self.get_history_length()
@@ -60,30 +92,15 @@ class BhHistory:
         if ll == 1:
             return self.history[0]
 
+        last_point = self.history[-1]
+
+        # The first point of the history is never used.
+        weights = _get_smoothing_weights(smoothing_quality, smoothing_factor)[: ll - 1]
+
         coords_x = 0.0
         coords_y = 0.0
-        velocity = 0.01  # TODO: Get from BhPoint
-        velocity_sum = 0.0
         scale_sum = 0.0
-        gaussian_weight = 0.0
-        gaussian_weight_sqr = smoothing_factor * smoothing_factor
-
-        max_index = ll - 1
-        min_index = max(0, ll - smoothing_quality)
-
-        if gaussian_weight_sqr != 0.0:
-            gaussian_weight = 1 / (math.sqrt(2 * math.pi) * smoothing_factor)
-
-        last_point = self.history[max_index]
-
-        for index in range(max_index, min_index, -1):
-            rate = 0.0
-            next_coord = self.history[index]
-
-            if gaussian_weight_sqr != 0.0:
-                velocity_sum += velocity * 100
-                rate = gaussian_weight * math.exp(-velocity_sum * velocity_sum / (2 * gaussian_weight_sqr))
-
+        for rate, next_coord in zip(weights, reversed(self.history)):
             scale_sum += rate
             coords_x += rate * next_coord.x
             coords_y += rate * next_coord.y
@@ -93,4 +110,4 @@ class BhHistory:
         else:
             coords_x /= scale_sum
             coords_y /= scale_sum
-            return BhPoint(coords_x, coords_y, last_point.pressure)
+            return BhPoint(coords_x, coords_y, last_point.pressure, last_point.time)
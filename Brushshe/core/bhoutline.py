@@ -0,0 +1,90 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from bisect import bisect_left, bisect_right
+
+from PIL import Image, ImageChops
+
+
+def _edge_runs(image: Image):
+    # Horizontal edges between the rows of the padded binary image: [(y, x1, x2), ...] in the picture coordinates.
+    w, h = image.size
+    diff = ImageChops.difference(image.crop((0, 0, w, h - 1)), image.crop((0, 1, w, h)))
+    data = diff.tobytes()
+
+    # The first and last columns are the padding, so the runs never cross the rows.
+    # The image is binary (0 or 255), so the runs are found by the fast bytes.find.
+    runs = []
+    start = data.find(b"\xff")
+    while start != -1:
+        end = data.find(b"\x00", start)
+        y, x1 = divmod(start, w)
+        # The padded column c is the picture x = c - 1.
+        runs.append((y, x1 - 1, x1 - 1 + end - start))
+        start = data.find(b"\xff", end)
+    return runs
+
+
+def bh_mask_outline(mask: Image):
+    # Outline of the selected part (>= 128) of the mask as closed loops along the pixel edges.
+    # Return list of flat lists [x0, y0, x1, y1, ...] in the picture coordinates.
+    w, h = mask.size
+    if mask.mode != "L":
+        mask = mask.convert("L")
+
+    padded = Image.new("L", (w + 2, h + 2), 0)
+    padded.paste(mask.point([0] * 128 + [255] * 128), (1, 1))
+
+    h_runs = _edge_runs(padded)
+    v_runs = _edge_runs(padded.transpose(Image.TRANSPOSE))  # (x, y1, y2)
+
+    # The vertical edges can end inside a horizontal run (the diagonal touch of two parts),
+    #   so the runs are split there to have all the vertices at the ends of the edges.
+    v_ends = {}
+    for x, y1, y2 in v_runs:
+        v_ends.setdefault(y1, []).append(x)
+        v_ends.setdefault(y2, []).append(x)
+    for xs in v_ends.values():
+        xs.sort()
+
+    edges = []
+    for y, x1, x2 in h_runs:
+        xs = v_ends.get(y, ())
+        i1 = bisect_right(xs, x1)
+        i2 = bisect_left(xs, x2)
+        x_prev = x1
+        for x in xs[i1:i2]:
+            if x != x_prev:
+                edges.append(((x_prev, y), (x, y)))
+                x_prev = x
+        edges.append(((x_prev, y), (x2, y)))
+    for x, y1, y2 in v_runs:
+        edges.append(((x, y1), (x, y2)))
+
+    vertices = {}
+    for i, (p1, p2) in enumerate(edges):
+        vertices.setdefault(p1, []).append(i)
+        vertices.setdefault(p2, []).append(i)
+
+    # Walk along the not used edges. Each vertex has 2 or 4 edges, so all walks are closed.
+    loops = []
+    used = bytearray(len(edges))
+    for i, (start, point) in enumerate(edges):
+        if used[i]:
+            continue
+        used[i] = 1
+        loop = [*start, *point]
+        while point != start:
+            for j in vertices[point]:
+                if not used[j]:
+                    break
+            else:
+                break
+            used[j] = 1
+            p1, p2 = edges[j]
+            point = p2 if p1 == point else p1
+            loop.extend(point)
+        loops.append(loop)
+
+    return loops
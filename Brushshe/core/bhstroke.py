@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from core.bhbrush import bh_draw_line, bh_line_bbox
+from PIL import Image, ImageChops, ImageDraw
+
+
+class BhStrokeBuffer:
+    # Scratch layer of one stroke: the coverage (L mode) in the growing box of the stroke and one color.
+    # It's shown over the picture by BhComposer and put to the picture only once at the end of the stroke,
+    #   so the overlapped dabs of the stroke with opacity don't make it darker.
+
+    modes = ("RGB", "RGBA", "L", "LA")  # Modes, where the colors can be blended.
+
+    def __init__(self, size: tuple[2], color, opacity: int = 255):
+        self.width, self.height = size  # Picture size.
+        self.color = color
+        self.opacity = opacity  # 0..255
+        self.box = None  # (left, top, right, bottom) of the coverage in the picture.
+        self.coverage = None
+        self.align = 64  # The box grows by the aligned steps, so it's not reallocated on each dab.
+
+    def grow(self, rect: tuple[4]):
+        x1 = max(0, int(rect[0]))
+        y1 = max(0, int(rect[1]))
+        x2 = min(self.width, int(rect[2]))
+        y2 = min(self.height, int(rect[3]))
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        if self.box is not None:
+            bx1, by1, bx2, by2 = self.box
+            if bx1 <= x1 and by1 <= y1 and x2 <= bx2 and y2 <= by2:
+                return
+            x1, y1, x2, y2 = min(x1, bx1), min(y1, by1), max(x2, bx2), max(y2, by2)
+
+        a = self.align
+        box = (
+            x1 // a * a,
+            y1 // a * a,
+            min(self.width, -(-x2 // a) * a),
+            min(self.height, -(-y2 // a) * a),
+        )
+        coverage = Image.new("L", (box[2] - box[0], box[3] - box[1]), 0)
+        if self.coverage is not None:
+            coverage.paste(self.coverage, (self.box[0] - box[0], self.box[1] - box[1]))
+        self.box = box
+        self.coverage = coverage
+
+    def set_coverage(self, coverage: Image.Image, x: int, y: int):
+        # Use the ready coverage (for example the text) with the left top corner at (x, y) of the picture.
+        # The coverage is not copied and not changed, the box can be out of the picture.
+        # Return the old and the new boxes to redraw.
+        old_box = self.box
+        self.box = (x, y, x + coverage.width, y + coverage.height)
+        self.coverage = coverage
+        return old_box, self.box
+
+    def draw_line(self, x1, y1, x2, y2, size, brush_shape, tool, spacing=1):
+        # Same line as bh_draw_line, return its box.
+        return self.draw_polyline([(x1, y1), (x2, y2)], size, brush_shape, tool, spacing)
+
+    def draw_polyline(self, points: list, size, brush_shape, tool, spacing=1):
+        # Lines between the points [(x, y), ...] by one call: the box grows once for all of them.
+        # Return the box of the lines.
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        rect = bh_line_bbox(min(xs), min(ys), max(xs), max(ys), size)
+        self.grow(rect)
+        if self.box is not None:
+            ox, oy = self.box[:2]
+            draw = ImageDraw.Draw(self.coverage)
+            for (x1, y1), (x2, y2) in zip(points, points[1:]):
+                bh_draw_line(draw, x1 - ox, y1 - oy, x2 - ox, y2 - oy, 255, size, brush_shape, tool, spacing)
+        return rect
+
+    def intersects(self, box: tuple[4]):
+        return (
+            self.box is not None
+            and box[0] < self.box[2]
+            and self.box[0] < box[2]
+            and box[1] < self.box[3]
+            and self.box[1] < box[3]
+        )
+
+    def get_alpha(self, box: tuple[4], mask: Image.Image | None = None):
+        # Alpha of the stroke under the box of the picture (with the opacity and the selection mask).
+        ox, oy = self.box[:2]
+        alpha = self.coverage.crop((box[0] - ox, box[1] - oy, box[2] - ox, box[3] - oy))
+        if self.opacity < 255:
+            alpha = alpha.point([v * self.opacity // 255 for v in range(256)])
+        if mask is not None:
+            alpha = ImageChops.multiply(alpha, mask.crop(box))
+        return alpha
+
+    def apply(self, image: Image, box: tuple[4], mask: Image.Image | None = None):
+        # Draw the stroke on the image, which is the part (box) of the picture.
+        if self.intersects(box):
+            image.paste(self.color, (0, 0), self.get_alpha(box, mask))
+
+    def commit(self, image: Image, mask: Image.Image | None = None):
+        # Put the stroke to the picture. Return the changed box or None.
+        if self.box is None:
+            return None
+        image.paste(self.color, self.box, self.get_alpha(self.box, mask))
+        return self.box
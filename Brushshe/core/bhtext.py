@@ -0,0 +1,28 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+@lru_cache(maxsize=32)
+def bh_get_font(path: str, size: int, variation: str | None = None):
+    # Loading of the font file is slow, so the fonts are loaded once for each size.
+    # variation - the name of the style of the variable font (for example "Bold"), None is the default style.
+    font = ImageFont.truetype(path, size)
+    if variation is not None:
+        font.set_variation_by_name(variation)
+    return font
+
+
+@lru_cache(maxsize=32)
+def bh_get_text_layout(text: str, font: ImageFont.FreeTypeFont):
+    # Return (bbox, coverage) of the text drawn at (0, 0): bbox is the box of the text as ImageDraw.textbbox,
+    #   coverage is the L mask of the text in this box.
+    # The fonts are cached by bh_get_font, so the same font is the same key.
+    bbox = font.getbbox(text)
+    coverage = Image.new("L", (max(1, bbox[2] - bbox[0]), max(1, bbox[3] - bbox[1])), 0)
+    ImageDraw.Draw(coverage).text((-bbox[0], -bbox[1]), text, fill=255, font=font)
+    return bbox, coverage
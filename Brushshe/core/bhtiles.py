@@ -0,0 +1,97 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from PIL import Image
+
+
+class BhTiledImage:
+    # Picture stored as the tiles. Tiles are never changed after they are stored, so the snapshots
+    #   share all the not changed tiles (copy-on-write).
+
+    def __init__(self, mode: str, size: tuple[2], tile_size: int = 256):
+        self.mode = mode
+        self.size = size
+        self.tile_size = tile_size
+        self.tiles = {}  # (tile x, tile y): image
+        self.info = {}
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @classmethod
+    def from_image(cls, image: Image, tile_size: int = 256):
+        tiled_image = cls(image.mode, image.size, tile_size)
+        tiled_image.info = image.info.copy()
+        for tx, ty in tiled_image.get_tiles_in_box((0, 0, image.width, image.height)):
+            tiled_image.tiles[(tx, ty)] = image.crop(tiled_image.get_tile_box(tx, ty))
+        return tiled_image
+
+    def get_tile_box(self, tx, ty):
+        x1 = tx * self.tile_size
+        y1 = ty * self.tile_size
+        return x1, y1, min(x1 + self.tile_size, self.width), min(y1 + self.tile_size, self.height)
+
+    def get_tiles_in_box(self, box: tuple[4]):
+        # Tiles under the box (left, top, right, bottom).
+        x1 = max(0, int(box[0]))
+        y1 = max(0, int(box[1]))
+        x2 = min(self.width, int(box[2]))
+        y2 = min(self.height, int(box[3]))
+        if x1 >= x2 or y1 >= y2:
+            return []
+        return [
+            (tx, ty)
+            for ty in range(y1 // self.tile_size, (y2 - 1) // self.tile_size + 1)
+            for tx in range(x1 // self.tile_size, (x2 - 1) // self.tile_size + 1)
+        ]
+
+    def is_compatible(self, image: Image):
+        return image.mode == self.mode and image.size == self.size
+
+    def copy(self):
+        tiled_image = BhTiledImage(self.mode, self.size, self.tile_size)
+        tiled_image.tiles = self.tiles.copy()
+        tiled_image.info = self.info.copy()
+        return tiled_image
+
+    def with_changes(self, image: Image, boxes: list | None = None):
+        # New snapshot of the image, which was made from this one. Only the tiles under the changed boxes
+        #   are copied from the image, the rest are shared. If boxes is None, changed tiles are found by
+        #   comparing (slower, but still shares the memory). If nothing is changed, this snapshot is returned.
+        if not self.is_compatible(image):
+            return BhTiledImage.from_image(image, self.tile_size)
+
+        tiled_image = self.copy()
+        tiled_image.info = image.info.copy()
+        is_changed = tiled_image.info != self.info
+
+        if boxes is None:
+            for key, tile in self.tiles.items():
+                new_tile = image.crop(self.get_tile_box(*key))
+                if new_tile.tobytes() != tile.tobytes():
+                    tiled_image.tiles[key] = new_tile
+                    is_changed = True
+        else:
+            for box in boxes:
+                for key in self.get_tiles_in_box(box):
+                    if tiled_image.tiles[key] is self.tiles[key]:
+                        tiled_image.tiles[key] = image.crop(self.get_tile_box(*key))
+                        is_changed = True
+
+        return tiled_image if is_changed else self
+
+    def to_image(self):
+        # Plain PIL image, for example for save or addons.
+        image = Image.new(self.mode, self.size)
+        if self.mode == "P" and len(self.tiles) > 0:
+            image.putpalette(next(iter(self.tiles.values())).getpalette())
+        for (tx, ty), tile in self.tiles.items():
+            image.paste(tile, (tx * self.tile_size, ty * self.tile_size))
+        image.info = self.info.copy()
+        return image
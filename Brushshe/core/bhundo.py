@@ -0,0 +1,506 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import math
+import mmap
+import os
+import zlib
+
+from core.bhtiles import BhTiledImage
+from PIL import Image
+
+
+class BhUndoJournal:
+    # Append-only file for the history entries spilled from the memory. It is read back by mmap.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mmap = None
+        self.size = 0
+
+    def write(self, data: bytes):
+        # Return the offset of the data in the journal.
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, "w+b")
+            self.size = 0
+
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.size += len(data)
+        return offset
+
+    def read(self, offset: int, length: int):
+        if self.mmap is None or len(self.mmap) < offset + length:
+            # The journal was grown, map it again.
+            self.file.flush()
+            if self.mmap is not None:
+                self.mmap.close()
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmap[offset : offset + length]
+
+    def compact(self, tiles: list):
+        # Move the given spilled tiles to the begin of the journal and cut the rest, so the space of the other
+        #   (removed) tiles is freed. The tiles are moved in place in order of their offsets.
+        if self.file is None:
+            return
+
+        offset = 0
+        for packed in sorted(tiles, key=lambda packed: packed.offset):
+            if packed.offset != offset:
+                data = self.read(packed.offset, packed.length)
+                self.file.seek(offset)
+                self.file.write(data)
+                packed.offset = offset
+            offset += packed.length
+
+        # The map must be closed before the file is cut.
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.flush()
+        self.file.truncate(offset)
+        self.size = offset
+
+    def close(self):
+        # Remove the journal file. All the spilled tiles are lost, so the history must be cleared before.
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                print("Warning: Can't remove the history journal.")
+        self.size = 0
+
+
+class BhPackedTile:
+    # Tile compressed by zlib. The data can be spilled to the journal.
+
+    def __init__(self, tile: Image):
+        self.mode = tile.mode
+        self.size = tile.size
+        self.palette = tile.getpalette() if tile.mode == "P" else None
+        self.data = zlib.compress(tile.tobytes(), 1)
+        self.journal = None
+        self.offset = 0
+        self.length = len(self.data)
+        self.refs = 0  # Count of the layers of the history entries, which keep the tile.
+
+    def is_spilled(self):
+        return self.data is None
+
+    def spill(self, journal: BhUndoJournal):
+        self.offset = journal.write(self.data)
+        self.journal = journal
+        self.data = None
+
+    def get_data(self):
+        if self.data is None:
+            return self.journal.read(self.offset, self.length)
+        return self.data
+
+    def unpack(self):
+        tile = Image.frombytes(self.mode, self.size, zlib.decompress(self.get_data()))
+        if self.palette is not None:
+            tile.putpalette(self.palette)
+        return tile
+
+
+class BhUndoLayer:
+    # One layer (picture or mask) of the history entry.
+
+    def __init__(self, snapshot: BhTiledImage, tiles: dict, is_checkpoint: bool):
+        self.mode = snapshot.mode
+        self.size = snapshot.size
+        self.tile_size = snapshot.tile_size
+        self.info = snapshot.info.copy()
+        self.tiles = tiles  # Packed tiles: all for the checkpoint, or only the changed since the previous entry.
+        self.is_checkpoint = is_checkpoint
+
+
+class BhUndoEntry:
+    def __init__(self, kind: str, layers: dict):
+        self.kind = kind  # "pixels", "mask" or "resize".
+        self.layers = layers  # "image" and "mask": BhUndoLayer or None (no mask).
+
+
+class BhUndoChange:
+    # What is changed by moving the history cursor.
+
+    def __init__(self):
+        self.image_keys = None  # Changed picture tiles. None - the whole picture (size or mode is changed).
+        self.is_mask_changed = False
+
+
+class BhUndoHistory:
+    # One history for undo and redo: the list of the entries and the cursor on the current one.
+    #   Undo and redo only move the cursor, the entries are not copied.
+    # Entries keep the picture and the selection mask as the tiled snapshots. Entries keep only the packed
+    #   tiles changed since the previous entry, and every checkpoint_interval entry is the full checkpoint,
+    #   so any state is restored by the checkpoint and a few deltas. Not changed tiles are packed once
+    #   and shared between the entries.
+    # The history is limited by the memory size. If the journal is set, the oldest entries over the limit
+    #   are spilled to it instead of removing, while the spilled tiles of the entries fit max_disk_size.
+
+    layer_names = ("image", "mask")
+
+    def __init__(
+        self,
+        max_size: int,
+        checkpoint_interval: int = 10,
+        journal: BhUndoJournal | None = None,
+        max_disk_size: int = 0,
+    ):
+        self.entries = []
+        self.cursor = -1
+        self.max_size = max_size  # In bytes.
+        self.journal = journal
+        self.max_disk_size = max_disk_size  # In bytes.
+        self.checkpoint_interval = checkpoint_interval
+
+        # Packed tiles kept by the entries (by the reference counts), from the oldest, and their sizes.
+        self.memory_tiles = {}
+        self.disk_tiles = {}
+        self.memory_size = 0  # In bytes.
+        self.disk_size = 0  # In bytes.
+
+        # Full (not packed) state of the current entry and its packed tiles.
+        self.head = {"image": None, "mask": None}
+        self.head_packed = {"image": {}, "mask": {}}
+
+        # Thumbnails of the entries are the picture reduced by 2^n to fit thumbnail_size (see get_thumbnail).
+        self.thumbnail_size = 128
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_max_size(self, max_size: int):
+        self.max_size = max_size
+        self.trim()
+
+    def get_size(self):
+        # Memory used by the packed tiles, in bytes.
+        return self.memory_size
+
+    def get_disk_size(self):
+        # Size of the spilled tiles of the entries, in bytes.
+        return self.disk_size
+
+    def add_tiles(self, tiles: dict):
+        # The tiles are kept by one more layer.
+        for packed in tiles.values():
+            if packed.refs == 0:
+                if packed.is_spilled():
+                    self.disk_tiles[id(packed)] = packed
+                    self.disk_size += packed.length
+                else:
+                    self.memory_tiles[id(packed)] = packed
+                    self.memory_size += packed.length
+            packed.refs += 1
+
+    def remove_tiles(self, tiles: dict):
+        # The tiles are not kept by the layer anymore. The tiles without the layers are forgotten.
+        for packed in tiles.values():
+            packed.refs -= 1
+            if packed.refs == 0:
+                if packed.is_spilled():
+                    del self.disk_tiles[id(packed)]
+                    self.disk_size -= packed.length
+                else:
+                    del self.memory_tiles[id(packed)]
+                    self.memory_size -= packed.length
+
+    def add_entry(self, entry: BhUndoEntry):
+        self.entries.append(entry)
+        for layer in entry.layers.values():
+            if layer is not None:
+                self.add_tiles(layer.tiles)
+
+    def remove_entry(self, index: int):
+        for layer in self.entries[index].layers.values():
+            if layer is not None:
+                self.remove_tiles(layer.tiles)
+        del self.entries[index]
+
+    def clear(self):
+        self.entries = []
+        self.cursor = -1
+        self.memory_tiles = {}
+        self.disk_tiles = {}
+        self.memory_size = 0
+        self.disk_size = 0
+        self.head = {"image": None, "mask": None}
+        self.head_packed = {"image": {}, "mask": {}}
+
+    def get_image(self):
+        return self.head["image"]
+
+    def get_mask(self):
+        return self.head["mask"]
+
+    def can_undo(self):
+        return self.cursor > 0
+
+    def can_redo(self):
+        return self.cursor < len(self.entries) - 1
+
+    def record(self, image: Image, image_boxes: list | None, mask: Image.Image | None, is_mask_changed: bool):
+        # Add the entry after the current one, the entries for redo are forgotten.
+        # image_boxes - changed parts of the picture, if None - the tiles are compared.
+        # Return False, if nothing is changed: then no entry is added and the redo entries are kept.
+        if mask is not None and mask.size != image.size:
+            # The mask of the other picture can't be restored with this one.
+            print("Warning: The selection mask size doesn't match the picture, it isn't stored in the history.")
+            mask = None
+            is_mask_changed = True
+        head_image = self.head["image"]
+        if head_image is not None and head_image.is_compatible(image):
+            image_snapshot = head_image.with_changes(image, image_boxes)
+            kind = "pixels"
+        else:
+            image_snapshot = BhTiledImage.from_image(image)
+            kind = "resize"
+
+        head_mask = self.head["mask"]
+        if mask is None:
+            mask_snapshot = None
+        elif head_mask is not None and head_mask.is_compatible(mask):
+            mask_snapshot = head_mask.with_changes(mask) if is_mask_changed else head_mask
+        else:
+            mask_snapshot = BhTiledImage.from_image(mask)
+
+        # with_changes returns the same snapshot, if nothing is changed.
+        if kind == "pixels" and image_snapshot is head_image and mask_snapshot is head_mask:
+            return False
+
+        while len(self.entries) > self.cursor + 1:
+            self.remove_entry(len(self.entries) - 1)
+
+        layers = {}
+        layers["image"], image_changed = self.pack_layer("image", image_snapshot)
+        layers["mask"], mask_changed = self.pack_layer("mask", mask_snapshot)
+        mask_changed = len(mask_changed) > 0 or (mask_snapshot is None) != (head_mask is None)
+
+        if kind == "pixels" and len(image_changed) == 0 and mask_changed:
+            kind = "mask"
+
+        self.add_entry(BhUndoEntry(kind, layers))
+        self.cursor = len(self.entries) - 1
+        self.trim()
+        return True
+
+    def pack_layer(self, name: str, snapshot: BhTiledImage | None):
+        # Return the layer for the new entry and its changed tiles.
+        head = self.head[name]
+        self.head[name] = snapshot
+        if snapshot is None:
+            self.head_packed[name] = {}
+            return None, {}
+
+        is_same = (
+            head is not None
+            and head.mode == snapshot.mode
+            and head.size == snapshot.size
+            and head.tile_size == snapshot.tile_size
+        )
+
+        # The snapshot shares the not changed tiles with the previous one, they are not packed again.
+        packed_tiles = {}
+        changed = {}
+        for key, tile in snapshot.tiles.items():
+            if is_same and head.tiles.get(key) is tile:
+                packed_tiles[key] = self.head_packed[name][key]
+            else:
+                packed_tiles[key] = changed[key] = BhPackedTile(tile)
+        self.head_packed[name] = packed_tiles
+
+        if is_same and self.get_deltas_count(name, len(self.entries) - 1) < self.checkpoint_interval:
+            return BhUndoLayer(snapshot, changed, False), changed
+        return BhUndoLayer(snapshot, packed_tiles, True), changed
+
+    def get_thumbnail_divider(self, size: tuple[2]):
+        n = 1
+        while max(size) / n > self.thumbnail_size and n < 256:
+            n *= 2
+        return n
+
+    def get_thumbnail(self, index: int, previous: Image.Image | None = None):
+        # The picture of the entry reduced by 2^n to fit thumbnail_size. It's made on demand from the packed tiles,
+        #   so the entries keep no thumbnails.
+        # previous - the thumbnail of the previous entry, then only the changed tiles are unpacked. If the picture
+        #   is not changed, previous itself is returned.
+        layer = self.entries[index].layers["image"]
+        n = self.get_thumbnail_divider(layer.size)
+        size = (math.ceil(layer.size[0] / n), math.ceil(layer.size[1] / n))
+
+        if layer.is_checkpoint:
+            thumbnail = Image.new("RGBA", size)
+            packed_tiles = layer.tiles
+        elif previous is not None and previous.size == size:
+            if len(layer.tiles) == 0:
+                return previous
+            thumbnail = previous.copy()
+            packed_tiles = layer.tiles
+        else:
+            thumbnail = Image.new("RGBA", size)
+            packed_tiles = self.get_packed_tiles("image", index)
+
+        for (tx, ty), packed in packed_tiles.items():
+            tile = packed.unpack()
+            thumbnail.paste(tile.convert("RGBA").reduce(n), (tx * layer.tile_size // n, ty * layer.tile_size // n))
+        return thumbnail
+
+    def get_deltas_count(self, name: str, index: int):
+        # Deltas since the last checkpoint of the layer.
+        count = 0
+        while index >= 0:
+            layer = self.entries[index].layers[name]
+            if layer is None or layer.is_checkpoint:
+                break
+            count += 1
+            index -= 1
+        return count
+
+    def undo(self):
+        if not self.can_undo():
+            return None
+        return self.jump(self.cursor - 1)
+
+    def redo(self):
+        if not self.can_redo():
+            return None
+        return self.jump(self.cursor + 1)
+
+    def jump(self, index: int):
+        # Move the cursor to the entry. Only the tiles which differ from the current state are unpacked.
+        self.cursor = index
+        change = BhUndoChange()
+
+        for name in self.layer_names:
+            head = self.head[name]
+            head_packed = self.head_packed[name]
+            layer = self.entries[index].layers[name]
+
+            if layer is None:
+                if head is not None:
+                    change.is_mask_changed = True
+                self.head[name] = None
+                self.head_packed[name] = {}
+                continue
+
+            packed_tiles = self.get_packed_tiles(name, index)
+            is_same = head is not None and head.mode == layer.mode and head.size == layer.size
+
+            state = BhTiledImage(layer.mode, layer.size, layer.tile_size)
+            state.info = layer.info.copy()
+            changed_keys = []
+            for key, packed in packed_tiles.items():
+                if is_same and head_packed.get(key) is packed:
+                    state.tiles[key] = head.tiles[key]
+                else:
+                    state.tiles[key] = packed.unpack()
+                    changed_keys.append(key)
+
+            self.head[name] = state
+            self.head_packed[name] = packed_tiles
+
+            if name == "image":
+                change.image_keys = changed_keys if is_same else None
+            elif not is_same or len(changed_keys) > 0:
+                change.is_mask_changed = True
+
+        return change
+
+    def get_packed_tiles(self, name: str, index: int):
+        # Packed tiles of the layer: the nearest checkpoint before it and the deltas after the checkpoint.
+        i = index
+        while not self.entries[i].layers[name].is_checkpoint:
+            i -= 1
+
+        packed_tiles = {}
+        for k in range(i, index + 1):
+            packed_tiles.update(self.entries[k].layers[name].tiles)
+        return packed_tiles
+
+    def trim(self):
+        # The current state is always kept. The oldest entries are spilled first, and removed only when it
+        #   lowers the used memory, or frees the journal for the next spilling.
+        while self.memory_size > self.max_size:
+            self.spill(self.memory_size - self.max_size)
+            if self.memory_size <= self.max_size or len(self.entries) <= 1:
+                break
+
+            # Nothing to undo, so the last redo is removed. Else the oldest checkpoint is removed.
+            index = len(self.entries) - 1 if self.cursor == 0 else 0
+            if index == 0:
+                # The next entry becomes the checkpoint, so the tiles still used by it are not freed.
+                for name, layer in self.entries[1].layers.items():
+                    if layer is not None and not layer.is_checkpoint:
+                        tiles = self.get_packed_tiles(name, 1)
+                        self.add_tiles(tiles)
+                        self.remove_tiles(layer.tiles)
+                        layer.tiles = tiles
+                        layer.is_checkpoint = True
+
+            # Tiles kept only by the entry are freed with it.
+            freed = [
+                packed
+                for layer in self.entries[index].layers.values()
+                if layer is not None
+                for packed in layer.tiles.values()
+                if packed.refs == 1
+            ]
+            freed_memory = sum(packed.length for packed in freed if not packed.is_spilled())
+
+            # The removed spilled tiles are useful only, if the other tiles can be spilled to their place.
+            if freed_memory == 0 and (len(freed) == 0 or not self.can_spill()):
+                break
+
+            self.remove_entry(index)
+            if index == 0:
+                self.cursor -= 1
+
+    def get_spillable_tiles(self):
+        # Not spilled tiles of the entries except the current one, from the oldest.
+        if self.journal is None or self.cursor < 0:
+            return
+        current = {
+            id(packed)
+            for layer in self.entries[self.cursor].layers.values()
+            if layer is not None
+            for packed in layer.tiles.values()
+        }
+        for key, packed in list(self.memory_tiles.items()):
+            if key not in current:
+                yield packed
+
+    def can_spill(self):
+        return next(self.get_spillable_tiles(), None) is not None
+
+    def spill(self, needed_size: int):
+        # Spill the tiles to the journal, until needed_size bytes of the memory are freed or the journal is full.
+        # Only the tiles of the entries are counted, so the space of the removed entries is reused.
+        if self.journal is None:
+            return
+
+        if self.journal.size - self.disk_size > self.max_disk_size:
+            # Too many removed tiles in the journal.
+            self.journal.compact(list(self.disk_tiles.values()))
+
+        spilled_size = 0
+        for packed in self.get_spillable_tiles():
+            if spilled_size >= needed_size or self.disk_size + packed.length > self.max_disk_size:
+                break
+            packed.spill(self.journal)
+            del self.memory_tiles[id(packed)]
+            self.disk_tiles[id(packed)] = packed
+            self.memory_size -= packed.length
+            self.disk_size += packed.length
+            spilled_size += packed.length
@@ -18,12 +18,13 @@ from .addon_manager import AddonManager
 from .change_size import ChangeSize
 from .frames import Frames
 from .gallery import Gallery
+from .history import History
 from .menubar import MenuBar
 from .settings import Settings
 from .stickers import Stickers
 
 
-class BrushsheGui(ctk.CTk, MenuBar, ChangeSize, Settings, Stickers, Frames, Gallery, AddonManager):
+class BrushsheGui(ctk.CTk, MenuBar, ChangeSize, Settings, Stickers, Frames, Gallery, History, AddonManager):
     def __init__(self):
         super().__init__(className="Brushshe")
         self.logic = BrushsheLogic(self)
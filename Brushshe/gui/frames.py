@@ -18,7 +18,7 @@ class Frames:
 
             self.logic.image.paste(resized_frame, (0, 0), resized_frame)
 
-            self.logic.update_canvas()
+            self.logic.request_redraw()
             self.logic.record_action()
 
         frames_win = ctk.CTkToplevel(self)
@@ -0,0 +1,98 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import customtkinter as ctk
+from ui.scroll import scroll
+from utils.translator import _
+
+
+class History:
+    def show_history(self):
+        if getattr(self, "history_win", None) is not None and self.history_win.winfo_exists():
+            self.history_win.focus()
+            return
+
+        self.history_win = ctk.CTkToplevel(self)
+        self.history_win.title(_("History"))
+        self.history_win.geometry("260x520")
+        self.history_win.wm_iconbitmap()
+        self.history_win.after(300, lambda: self.history_win.iconphoto(False, self.iconpath))
+
+        self.history_frame = ctk.CTkScrollableFrame(self.history_win)
+        self.history_frame.pack(fill=ctk.BOTH, expand=True)
+        scroll(self.history_frame)
+
+        # Rows of the entries: id(entry) -> (entry, button, thumbnail). The thumbnails are made by the history
+        #   only for the shown rows, so they are not kept while the panel is closed.
+        # Thumbnails: id(thumbnail) -> (thumbnail, CTkImage). The entries with the same picture share
+        #   the thumbnail, so the CTkImage is created once for them.
+        self.history_rows = {}
+        self.history_thumbnails = {}
+
+        self.logic.on_history_change = self.update_history_rows
+        self.history_win.bind("<Destroy>", self.on_history_destroy)
+
+        self.update_history_rows()
+
+    def on_history_destroy(self, event):
+        if event.widget is self.history_win:
+            self.logic.on_history_change = None
+            self.history_rows = {}
+            self.history_thumbnails = {}
+
+    def get_history_thumbnail(self, thumbnail):
+        key = id(thumbnail)
+        if key not in self.history_thumbnails:
+            preview_size = 64
+            scale = min(preview_size / thumbnail.width, preview_size / thumbnail.height, 1)
+            size = (max(1, round(thumbnail.width * scale)), max(1, round(thumbnail.height * scale)))
+            # The thumbnail is kept with its CTkImage, so its id is not reused while the item is alive.
+            self.history_thumbnails[key] = (thumbnail, ctk.CTkImage(thumbnail, size=size))
+        return self.history_thumbnails[key][1]
+
+    def update_history_rows(self):
+        # Only the rows of the new entries are created, the rows of the forgotten entries are destroyed.
+        kind_names = {
+            "pixels": _("Drawing"),
+            "mask": _("Selection"),
+            "resize": _("Picture"),
+        }
+        theme = ctk.ThemeManager.theme["CTkButton"]
+        history = self.logic.history
+        entries = {id(entry): entry for entry in history.entries}
+
+        for key, (row_entry, row, thumbnail) in list(self.history_rows.items()):
+            if entries.get(key) is not row_entry:
+                del self.history_rows[key]
+                row.destroy()
+
+        thumbnail = None
+        for index, entry in enumerate(history.entries):
+            if id(entry) in self.history_rows:
+                row, thumbnail = self.history_rows[id(entry)][1:]
+            else:
+                # The rows are created in order, so only the changes since the previous row are unpacked.
+                thumbnail = history.get_thumbnail(index, thumbnail)
+                row = ctk.CTkButton(
+                    self.history_frame,
+                    text=kind_names[entry.kind],
+                    image=self.get_history_thumbnail(thumbnail),
+                    compound="left",
+                    anchor="w",
+                )
+                self.history_rows[id(entry)] = (entry, row, thumbnail)
+            # Indexes are changed when the oldest entries are forgotten.
+            row.configure(
+                command=lambda index=index: self.logic.jump_history(index),
+                fg_color=theme["fg_color"] if index == history.cursor else "transparent",
+                text_color=theme["text_color"] if index <= history.cursor else theme["text_color_disabled"],
+            )
+            row.grid(column=0, row=index, padx=5, pady=2, sticky="ew")
+
+        thumbnails = {id(row[2]) for row in self.history_rows.values()}
+        for key in list(self.history_thumbnails):
+            if key not in thumbnails:
+                del self.history_thumbnails[key]
+
+        self.history_frame.grid_columnconfigure(0, weight=1)
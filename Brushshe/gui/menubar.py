@@ -54,6 +54,8 @@ class MenuBar:
         view_dropdown.add_option(option=_("Zoom Out"), command=self.logic.zoom_out)
         view_dropdown.add_separator()
         view_dropdown.add_option(option=_("Reset"), command=self.logic.reset_zoom)
+        view_dropdown.add_separator()
+        view_dropdown.add_option(option=_("History"), command=self.show_history)
 
         """Tools menu"""
         tools_menu = menu.add_cascade(_("Tools"))
@@ -3,7 +3,6 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import webbrowser
-from collections import deque
 
 import customtkinter as ctk
 from constants import Constants
@@ -22,11 +21,15 @@ class Settings:
             config.set("Brushshe", "theme", mode)
             write_config()
 
-        def change_undo_levels():
-            self.logic.undo_stack = deque(self.logic.undo_stack, maxlen=undo_levels_spinbox.get())
-            self.logic.redo_stack = deque(self.logic.redo_stack, maxlen=undo_levels_spinbox.get())
-            config.set("Brushshe", "undo_levels", str(undo_levels_spinbox.get()))
+        def change_history_size():
+            self.logic.history.set_max_size(history_size_spinbox.get() * 1024 * 1024)
+            config.set("Brushshe", "history_size", str(history_size_spinbox.get()))
             write_config()
+            history_usage_label.configure(text=get_history_usage_text())
+
+        def get_history_usage_text():
+            size = self.logic.history.get_size()
+            return f"{_('History memory usage:')} {size / 1024 / 1024:.1f} MB"
 
         def smooth_switch_event():
             self.logic.is_brush_smoothing = smooth_var.get()
@@ -43,6 +46,18 @@ class Settings:
             config.set("Brushshe", "brush_smoothing_factor", str(self.logic.brush_smoothing_factor))
             write_config()
 
+        def opacity_event(value):
+            self.logic.brush_opacity = int(value)
+            config.set("Brushshe", "brush_opacity", str(self.logic.brush_opacity))
+            write_config()
+            opacity_label.configure(text=f"{_('Brush opacity')}: {self.logic.brush_opacity}%")
+
+        def spacing_event(value):
+            self.logic.brush_spacing = int(value)
+            config.set("Brushshe", "brush_spacing", str(self.logic.brush_spacing))
+            write_config()
+            spacing_label.configure(text=f"{_('Brush spacing')}: {self.logic.brush_spacing}%")
+
         def mask_radiobutton_callback():
             self.logic.set_mask_type(mask_var.get())
             config.set("Brushshe", "mask", str(mask_var.get()))
@@ -94,16 +109,19 @@ class Settings:
         theme_btn.set(_(config.get("Brushshe", "theme").capitalize()))
         theme_btn.pack(padx=10, pady=10)
 
-        undo_levels_frame = ctk.CTkFrame(settings_frame)
-        undo_levels_frame.pack(padx=10, pady=10, fill="x")
+        history_size_frame = ctk.CTkFrame(settings_frame)
+        history_size_frame.pack(padx=10, pady=10, fill="x")
+
+        ctk.CTkLabel(history_size_frame, text=_("Undo/redo history size (MB)")).pack(padx=10, pady=10)
 
-        ctk.CTkLabel(undo_levels_frame, text=_("Maximum undo/redo levels")).pack(padx=10, pady=10)
+        history_size_spinbox = IntSpinbox(history_size_frame, width=150)
+        history_size_spinbox.pack(padx=10, pady=10)
+        history_size_spinbox.set(config.getint("Brushshe", "history_size"))
 
-        undo_levels_spinbox = IntSpinbox(undo_levels_frame, width=150)
-        undo_levels_spinbox.pack(padx=10, pady=10)
-        undo_levels_spinbox.set(self.logic.undo_stack.maxlen)
+        history_usage_label = ctk.CTkLabel(history_size_frame, text=get_history_usage_text())
+        history_usage_label.pack(padx=10, pady=10)
 
-        ctk.CTkButton(undo_levels_frame, text=_("Apply"), command=change_undo_levels).pack(padx=10, pady=10)
+        ctk.CTkButton(history_size_frame, text=_("Apply"), command=change_history_size).pack(padx=10, pady=10)
 
         smooth_frame = ctk.CTkFrame(settings_frame)
         smooth_frame.pack(padx=10, pady=10, fill="x")
@@ -128,6 +146,24 @@ class Settings:
         bsf_slider.set(self.logic.brush_smoothing_factor)
         bsf_slider.pack(padx=10, pady=10)
 
+        opacity_frame = ctk.CTkFrame(settings_frame)
+        opacity_frame.pack(padx=10, pady=10, fill="x")
+
+        opacity_label = ctk.CTkLabel(opacity_frame, text=f"{_('Brush opacity')}: {self.logic.brush_opacity}%")
+        opacity_label.pack(padx=10, pady=10)
+
+        opacity_slider = ctk.CTkSlider(opacity_frame, from_=1, to=100, command=opacity_event)
+        opacity_slider.set(self.logic.brush_opacity)
+        opacity_slider.pack(padx=10, pady=10)
+
+        spacing_label = ctk.CTkLabel(opacity_frame, text=f"{_('Brush spacing')}: {self.logic.brush_spacing}%")
+        spacing_label.pack(padx=10, pady=10)
+
+        # With 0% the dab is stamped on each pixel of the line.
+        spacing_slider = ctk.CTkSlider(opacity_frame, from_=0, to=50, command=spacing_event)
+        spacing_slider.set(self.logic.brush_spacing)
+        spacing_slider.pack(padx=10, pady=10)
+
         mask_frame = ctk.CTkFrame(settings_frame)
         mask_frame.pack(padx=10, pady=10, fill="x")
 
@@ -2,12 +2,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from collections import deque
 from pathlib import Path
 
 import customtkinter as ctk
 from constants import Constants
 from core.bhcomposer import BhComposer
+from core.bhundo import BhUndoHistory, BhUndoJournal
+from utils import cache
 from utils.common import resource
 from utils.config_loader import config
 
@@ -39,11 +40,25 @@ class BrushsheLogic(
         self.ui = ui
 
         """From config"""
-        self.undo_stack = deque(maxlen=config.getint("Brushshe", "undo_levels"))
-        self.redo_stack = deque(maxlen=config.getint("Brushshe", "undo_levels"))
+        # Old history entries over the memory limit are spilled to the journal in the cache folder.
+        self.history_journal = BhUndoJournal(cache.get_history_journal_path())
+        self.history = BhUndoHistory(
+            max_size=config.getint("Brushshe", "history_size") * 1024 * 1024,  # MB
+            journal=self.history_journal,
+            max_disk_size=config.getint("Brushshe", "history_disk_size") * 1024 * 1024,  # MB
+        )
+        # Changed parts of the picture since the last history snapshot. None - unknown (all can be changed).
+        self.history_dirty_rects = None
+        # The mask and its generation in the last history entry.
+        self.history_mask_img = None
+        self.history_mask_generation = 0
+        # Called after the history is changed (for the history panel).
+        self.on_history_change = None
         self.is_brush_smoothing = config.getboolean("Brushshe", "smoothing")
         self.brush_smoothing_factor = config.getint("Brushshe", "brush_smoothing_factor")  # Between: 3..64
         self.brush_smoothing_quality = config.getint("Brushshe", "brush_smoothing_quality")  # Between: 1..64
+        self.brush_opacity = config.getint("Brushshe", "brush_opacity")  # Percent.
+        self.brush_spacing = config.getint("Brushshe", "brush_spacing")  # Percent of the brush size.
         self.autosave_var = ctk.BooleanVar(value=config.getboolean("Brushshe", "autosave"))
 
         self.is_gradient_fill = ctk.BooleanVar(value=False)
@@ -56,6 +71,29 @@ class BrushsheLogic(
         self.canvas_tail_size = 128
         # If None - no crop, if set - need check out of crop.
         self.canvas_tails_area = None
+        # Extra tails rendered around the visible area, so small pans don't need a new frame.
+        self.canvas_tails_margin = config.getint("Brushshe", "render_margin")
+        self.prefetch_job = None
+
+        # Redraw scheduler. Canvas is redrawn not more often than once per redraw_interval.
+        self.redraw_interval = 16  # ms, ~60 fps
+        self.redraw_job = None
+        self.redraw_full = True
+        self.redraw_last_time = 0
+        self.img_tk_parts = {}  # Scratch Tk images for partial canvas updates by size.
+        self.img_tk_back = None  # Second Tk image of the frame size for moving the frame.
+
+        # Pointer samples of the current tool, drawn once per frame (see queue_input).
+        self.input_samples = []
+        self.input_drain = None
+        # Canvas items of the preview of the queued samples, and (items, dirty_rect) of the drawn samples,
+        #   which wait for the tiles.
+        self.input_preview_items = []
+        self.input_preview_drawn = []
+        # Counters to check that no sample is lost: received == processed after the stroke.
+        self.input_samples_received = 0
+        self.input_samples_processed = 0
+        self.input_frame_samples = 0  # Samples processed in the last frame.
 
         self.brush_color = "black"
         self.second_brush_color = "white"
@@ -81,16 +119,23 @@ class BrushsheLogic(
 
         self.composer = BhComposer(0, 0)  # Empty init.
         self.composer.mask_type = 0  # Type: 0 - fill, 1 - ants
+        self.composer.tile_size = self.canvas_tail_size
+        self.composer.set_cache_limit(config.getint("Brushshe", "render_cache_size") * 1024 * 1024)  # MB
+        self.composer.start_render_thread()
 
         self.zoom = 1
         self.selected_mask_img = None  # Can be gray_image or None
+        self.stroke = None  # BhStrokeBuffer of the brush stroke, which is painted now.
         self.current_file = None
         self.prev_x, self.prev_y = None, None
         self.current_font = "Open Sans"
         self.font_path = resource("assets/fonts/Open_Sans/OpenSans-VariableFont_wdth,wght.ttf")
 
         self.timer_mask_time_for_update = 200  # ms
-        self.timer_mask_last_update = 0
+        # Ants of the selection (mask_type 1) are the canvas lines along the outline of the mask.
+        self.ants_loops = None
+        self.ants_state = None  # (mask generation, zoom) of the drawn ants.
+        self.ants_offset = 0
         self.timer_mask_update = self.ui.after(self.timer_mask_time_for_update, self.mask_update)
 
         """Color themes"""
@@ -5,24 +5,22 @@
 import math
 import time
 
-from PIL import Image, ImageTk
+from PIL import ImageTk
 
 
 class CanvasOperations:
     def v_scrollbar_command(self, a, b, c=None):
         self.ui.canvas.yview(a, b, c)
-        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
-            self.update_canvas()
+        self.update_canvas_view()
 
     def h_scrollbar_command(self, a, b, c=None):
         self.ui.canvas.xview(a, b, c)
-        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
-            self.update_canvas()
+        self.update_canvas_view()
 
     def on_window_resize(self, event):
         # Update canvas after any resize window.
-        if self.zoom >= 1 and hasattr(self.ui, "canvas"):
-            self.update_canvas()
+        if hasattr(self.ui, "canvas"):
+            self.request_redraw(invalidate=False)
 
     def scroll_on_canvasy(self, event):
         if event.num == 5 or event.delta < 0:
@@ -30,8 +28,7 @@ class CanvasOperations:
         if event.num == 4 or event.delta > 0:
             count = -1
         self.ui.canvas.yview_scroll(count, "units")
-        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
-            self.update_canvas()
+        self.update_canvas_view()
 
     def scroll_on_canvasx(self, event):
         if event.num == 5 or event.delta < 0:
@@ -39,16 +36,14 @@ class CanvasOperations:
         if event.num == 4 or event.delta > 0:
             count = -1
         self.ui.canvas.xview_scroll(count, "units")
-        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
-            self.update_canvas()
+        self.update_canvas_view()
 
     def begin_moving_canvas(self, event):
         self.ui.canvas.scan_mark(event.x, event.y)
 
     def continue_moving_canvas(self, event):
         self.ui.canvas.scan_dragto(event.x, event.y, gain=1)
-        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
-            self.update_canvas()
+        self.update_canvas_view()
 
     def zoom_in(self, event=None):
         self.ui.canvas.delete("tools")
@@ -61,7 +56,7 @@ class CanvasOperations:
             self.zoom *= 2
 
         self.force_resize_canvas_with_correct()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
 
     def zoom_out(self, event=None):
         self.ui.canvas.delete("tools")
@@ -72,7 +67,7 @@ class CanvasOperations:
             self.zoom /= 2
 
         self.force_resize_canvas_with_correct()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
 
     def reset_zoom(self, event=None):
         self.ui.canvas.delete("tools")
@@ -80,7 +75,7 @@ class CanvasOperations:
         self.zoom = 1
 
         self.force_resize_canvas_with_correct()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
 
     def canvas_to_pict_xy(self, x, y):
         return self.ui.canvas.canvasx(x) // self.zoom, self.ui.canvas.canvasy(y) // self.zoom
@@ -88,118 +83,205 @@ class CanvasOperations:
     def canvas_to_pict_xy_f(self, x, y):
         return self.ui.canvas.canvasx(x) / self.zoom, self.ui.canvas.canvasy(y) / self.zoom
 
-    def update_canvas(self):
+    def update_canvas_view(self):
+        # The canvas was scrolled or moved. The rendered frame is moved with the canvas, so a new frame
+        #   is needed only when the visible area leaves it. The margin around is rendered on idle.
+        if self.canvas_tails_area is None:
+            return
+
+        x1, y1, x2, y2 = self.get_canvas_tails_area(margin=0)
+        rx1, ry1, rx2, ry2 = self.canvas_tails_area
+        if x1 < rx1 or y1 < ry1 or x2 > rx2 or y2 > ry2:
+            self.request_redraw(invalidate=False)
+        elif self.prefetch_job is None and self.get_canvas_tails_area() != self.canvas_tails_area:
+            self.prefetch_job = self.ui.after_idle(self._prefetch_canvas)
+
+    def _prefetch_canvas(self):
+        self.prefetch_job = None
+        if self.canvas_tails_area is not None and self.get_canvas_tails_area() != self.canvas_tails_area:
+            self.request_redraw(invalidate=False)
+
+    def request_redraw(self, dirty_rect=None, invalidate=True, document=True):
+        # Ask to redraw the canvas on the next frame. All requests before the frame are merged to one compose.
+        # dirty_rect - the changed part of the picture (left, top, right, bottom). If it is set, only this part
+        #   of the canvas will be recomposed, else the whole visible area.
+        # invalidate - without dirty_rect the whole picture can be changed. Set False if only the view is changed
+        #   (scroll, zoom, etc.), then the cached tiles will be used.
+        # document - set False if only the preview over the picture is changed (the picture is not), then
+        #   dirty_rect is not taken by the history.
+        self._sync_composer()
+
+        if dirty_rect is not None:
+            self.composer.add_dirty_rect(dirty_rect)
+            if document:
+                self.add_history_rect(dirty_rect)
+        else:
+            if invalidate:
+                self.composer.invalidate()
+                # Unknown changes, the next history snapshot compares all the tiles.
+                self.history_dirty_rects = None
+            self.redraw_full = True
+
+        self._schedule_redraw()
+
+    def add_history_rect(self, dirty_rect):
+        # The changed part of the picture, which is compared by the next history entry.
+        if self.history_dirty_rects is not None:
+            self.history_dirty_rects.append(dirty_rect)
+
+    def _schedule_redraw(self):
+        if self.redraw_job is None:
+            # Not more than one frame for redraw_interval.
+            delay = self.redraw_interval - int((time.perf_counter() - self.redraw_last_time) * 1000)
+            if delay > 0:
+                self.redraw_job = self.ui.after(delay, self._redraw_frame)
+            else:
+                self.redraw_job = self.ui.after_idle(self._redraw_frame)
+
+    def update_canvas(self, dirty_rect=None, invalidate=True):
+        # Redraw the canvas right now.
+        self.request_redraw(dirty_rect, invalidate)
+        self.flush_redraw()
+
+    def flush_redraw(self):
+        if self.redraw_job is not None:
+            self.ui.after_cancel(self.redraw_job)
+            self._redraw_frame()
+
+    def _sync_composer(self):
+        self.composer.set_l_image(self.image)
+        self.composer.set_mask_image(self.selected_mask_img)
+        self.composer.set_stroke(self.stroke)
+        self.composer.set_zoom(self.zoom)
+
+    def queue_input(self, event, drain, preview_item=None):
+        # Pointer samples are queued as they come and processed once per frame by drain(samples),
+        #   where samples is the list of (x, y, time) in the picture coordinates (float).
+        # drain returns the changed box of the picture or None (the whole picture).
+        # preview_item - the canvas item, which shows the sample right away. It's deleted, when the drawn
+        #   sample is shown on the canvas image.
+        self.input_samples.append((*self.canvas_to_pict_xy_f(event.x, event.y), event.time))
+        self.input_drain = drain
+        self.input_samples_received += 1
+        if preview_item is not None:
+            self.input_preview_items.append(preview_item)
+        self._schedule_redraw()
+
+    def drain_input(self):
+        if len(self.input_samples) == 0:
+            return
+
+        samples = self.input_samples
+        self.input_samples = []
+        items = self.input_preview_items
+        self.input_preview_items = []
+        self.input_samples_processed += len(samples)
+        self.input_frame_samples = len(samples)
+
+        dirty_rect = self.input_drain(samples)
+        self.input_preview_drawn.append((items, dirty_rect))
+
+    def _redraw_frame(self):
+        # The samples are drawn before the frame job is cleared, so their redraw requests go to this frame.
+        self.drain_input()
+        self.redraw_job = None
+        self.redraw_last_time = time.perf_counter()
+
         # Debug
         # t1 = time.perf_counter(), time.process_time()
 
         # self._update_canvas()
         self._tailing_update_canvas()
 
+        if self.composer.has_pending_tiles():
+            if self.redraw_job is None:
+                # Wait for the tiles from the render thread.
+                self.redraw_job = self.ui.after(self.redraw_interval, self._redraw_frame)
+
+        # The preview of the drawn samples is deleted, when the tiles under them are on the canvas image.
+        waiting = []
+        for items, dirty_rect in self.input_preview_drawn:
+            if self.composer.has_pending_tiles(dirty_rect):
+                waiting.append((items, dirty_rect))
+            elif len(items) > 0:
+                self.ui.canvas.delete(*items)
+        self.input_preview_drawn = waiting
+
+        self.update_ants()
+
         # Debug
         # t2 = time.perf_counter(), time.process_time()
         # print(f" Real time: {t2[0] - t1[0]:.6f} sec. CPU time: {t2[1] - t1[1]:.6f} sec")
 
-        self.timer_mask_last_update = int(time.time() * 1000)  # Set current time in ms
-
     def _tailing_update_canvas(self):
-        if self.zoom < 1:
-            # https://pillow.readthedocs.io/en/stable/handbook/concepts.html#concept-filters
-            canvas_image = self.image.resize(
-                (math.ceil(self.image.width * self.zoom), math.ceil(self.image.height * self.zoom)), Image.BOX
-            )
-            if self.selected_mask_img is None:
-                mask_image = None
-            else:
-                mask_image = self.selected_mask_img.resize(
-                    (
-                        math.ceil(self.selected_mask_img.width * self.zoom),
-                        math.ceil(self.selected_mask_img.height * self.zoom),
-                    ),
-                    Image.NEAREST,
-                )
-
-            tails_area = None
-
-            self.composer.set_l_image(canvas_image)
-            self.composer.set_mask_image(mask_image, tails_area)
+        self._sync_composer()
 
-            compose_image = self.composer.get_compose_image(0, 0, canvas_image.width - 1, canvas_image.height - 1)
+        tails_area = self.get_canvas_tails_area()
 
-            self.img_tk = ImageTk.PhotoImage(compose_image)
-            self.ui.canvas.itemconfig(self.canvas_image, image=self.img_tk)
-            self.ui.canvas.moveto(self.canvas_image, 0, 0)
+        if self.composer.can_compose_shifted(*tails_area):
+            # The frame of the same size is moved: reuse the overlapped part and render only the new strip.
+            box, position, parts = self.composer.get_shifted_compose_images(*tails_area)
+            self._shift_canvas_image(box, position, parts)
             self.canvas_tails_area = tails_area
+            self.redraw_full = False
 
-            return
-
-        else:  # data.zoom > 1 or data.zoom = 1:
-            # It work incorrect at this implementation for zoom < 1.
-
-            cw_full = math.ceil(self.image.width * self.zoom)
-            ch_full = math.ceil(self.image.height * self.zoom)
-
-            (x1, y1, x2, y2) = self.get_canvas_tails_area()
+        if self.redraw_full is False and self.composer.can_compose_dirty(*tails_area):
+            for part_image, x, y in self.composer.get_dirty_compose_images():
+                self._put_canvas_image_part(part_image, x, y)
+        else:
+            compose_image = self.composer.get_compose_image(*tails_area)
 
-            # Check, maybe the image all on canvas.
-            if x1 == 0 and y1 == 0 and x2 == cw_full - 1 and y2 == ch_full - 1:
-                x1_correct = 0
-                y1_correct = 0
-                dx = 0
-                dy = 0
-                tmp_canvas_image = self.image
-                tmp_mask_image = self.selected_mask_img
+            if self.img_tk.width() == compose_image.width and self.img_tk.height() == compose_image.height:
+                # The same viewport geometry - reuse the shown Tk image.
+                self.img_tk.paste(compose_image)
             else:
-                tiles_xy_on_image = (
-                    math.floor(x1 / self.zoom),
-                    math.floor(y1 / self.zoom),
-                    math.floor(x2 / self.zoom) + 1,
-                    math.floor(y2 / self.zoom) + 1,
-                )
-
-                # Subpixel correct.
-                x1_correct = tiles_xy_on_image[0] * self.zoom
-                y1_correct = tiles_xy_on_image[1] * self.zoom
-
-                dx = math.floor(x1 - x1_correct)
-                dy = math.floor(y1 - y1_correct)
-
-                # # Debug
-                # print((x1, y1, x2, y2), tiles_xy_on_image, (x1_correct, y1_correct), (dx, dy))
-
-                tmp_canvas_image = self.image.crop(tiles_xy_on_image)
-                if self.selected_mask_img is None:
-                    tmp_mask_image = None
-                else:
-                    tmp_mask_image = self.selected_mask_img.crop(tiles_xy_on_image)
-
-            r_w = math.floor(tmp_canvas_image.width * self.zoom)
-            r_h = math.floor(tmp_canvas_image.height * self.zoom)
-            if r_w < 1:
-                r_w = 1
-            if r_h < 1:
-                r_h = 1
-
-            canvas_image = tmp_canvas_image.resize((r_w, r_h), Image.NEAREST)
-            if tmp_mask_image is None:
-                mask_image = None
-            else:
-                mask_image = tmp_mask_image.resize((r_w, r_h), Image.NEAREST)
-
-            tails_area = (x1, y1, x2, y2)
-
-            self.composer.set_l_image(canvas_image)
-            self.composer.set_mask_image(mask_image, tails_area)
-
-            compose_image = self.composer.get_compose_image(x1, y1, x2 + dx, y2 + dy)
-
-            self.img_tk = ImageTk.PhotoImage(compose_image)
-            self.ui.canvas.itemconfig(self.canvas_image, image=self.img_tk)
-            self.ui.canvas.moveto(self.canvas_image, x1_correct, y1_correct)
+                # Reallocate only when the viewport geometry is changed.
+                self.img_tk = ImageTk.PhotoImage(compose_image)
+                self.img_tk_parts = {}
+                self.ui.canvas.itemconfig(self.canvas_image, image=self.img_tk)
+            self.ui.canvas.moveto(self.canvas_image, *self.composer.get_frame_position())
             self.canvas_tails_area = tails_area
+            self.redraw_full = False
+
+        # Tiles composed by the render thread. The main thread only uploads them.
+        for part_image, x, y in self.composer.get_ready_compose_images():
+            self._put_canvas_image_part(part_image, x, y)
+
+    def _shift_canvas_image(self, box, position, parts):
+        # Compose the moved frame in the back Tk image and show it, the shown image becomes the back one.
+        img_tk_back = self.img_tk_back
+        if img_tk_back is None or (img_tk_back.width(), img_tk_back.height()) != (
+            self.img_tk.width(),
+            self.img_tk.height(),
+        ):
+            img_tk_back = ImageTk.PhotoImage("RGB", (self.img_tk.width(), self.img_tk.height()))
+
+        self.ui.canvas.tk.call(str(img_tk_back), "copy", str(self.img_tk), "-from", *box, "-to", *position)
+        self.img_tk_back = self.img_tk
+        self.img_tk = img_tk_back
+
+        for part_image, x, y in parts:
+            self._put_canvas_image_part(part_image, x, y)
+
+        self.ui.canvas.itemconfig(self.canvas_image, image=self.img_tk)
+        self.ui.canvas.moveto(self.canvas_image, *self.composer.get_frame_position())
+
+    def _put_canvas_image_part(self, part_image, x, y):
+        # Upload only the changed part to the shown Tk image.
+        # ImageTk.PhotoImage.paste() can't paste to a box, so the part is uploaded to a scratch Tk image
+        # of the same size and then copied by Tk.
+        part_tk = self.img_tk_parts.get(part_image.size)
+        if part_tk is None:
+            part_tk = ImageTk.PhotoImage(part_image.mode, part_image.size)
+            self.img_tk_parts[part_image.size] = part_tk
+        part_tk.paste(part_image)
+        self.ui.canvas.tk.call(str(self.img_tk), "copy", str(part_tk), "-to", x, y)
+
+    def get_canvas_tails_area(self, margin=None):
+        # Tails area of the visible part of the canvas with the margin of tails around it.
+        if margin is None:
+            margin = self.canvas_tails_margin
 
-            return
-
-    def get_canvas_tails_area(self):
         cw_full = int(self.image.width * self.zoom)
         ch_full = int(self.image.height * self.zoom)
 
@@ -215,6 +297,11 @@ class CanvasOperations:
         y1 = math.floor(cy_frame_1 * ch_full / self.canvas_tail_size) * self.canvas_tail_size
         x2 = math.ceil(cx_frame_2 * cw_full / self.canvas_tail_size) * self.canvas_tail_size - 1
         y2 = math.ceil(cy_frame_2 * ch_full / self.canvas_tail_size) * self.canvas_tail_size - 1
+
+        x1 = max(0, x1 - margin * self.canvas_tail_size)
+        y1 = max(0, y1 - margin * self.canvas_tail_size)
+        x2 += margin * self.canvas_tail_size
+        y2 += margin * self.canvas_tail_size
         if x2 > cw_full - 1:
             x2 = cw_full - 1
         if y2 > ch_full - 1:
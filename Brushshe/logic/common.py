@@ -4,6 +4,7 @@
 
 import math
 import os
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
 from tkinter import filedialog
@@ -12,7 +13,7 @@ from uuid import uuid4
 
 import customtkinter as ctk
 from constants import Constants
-from core.bhbrush import bh_draw_line
+from core.bhbrush import bh_draw_line, bh_line_bbox
 from PIL import Image, ImageChops, ImageDraw, ImageEnhance, ImageFilter, ImageGrab, ImageOps, ImageStat, ImageTk
 from ui import messagebox
 from ui.color_picker import AskColor
@@ -61,6 +62,7 @@ class Common:
             self.destroy_app()
 
     def destroy_app(self):
+        self.clear_history()
         if self.is_reset_settings_after_exiting.get():
             os.remove(config_file_path)
         self.ui.destroy()
@@ -77,22 +79,87 @@ class Common:
                 color = common.rgb_tuple_to_rgba_tuple(self.rgb_color_to_tuple(color), 255)
         return color
 
-    def record_action(self):
-        self.undo_stack.append(self.image.copy())
+    def clear_history(self):
+        self.history.clear()
+        self.history_journal.close()
+        self.history_dirty_rects = None
+        self.history_mask_img = None
+        self.history_changed()
+
+    def history_changed(self):
+        if self.on_history_change is not None:
+            self.on_history_change()
+
+    def record_action(self, is_image_changed=True):
+        # One history for the picture and the selection mask. The new entry shares the not changed tiles
+        #   with the previous one, and without the known changed parts all the tiles are compared.
+        # is_image_changed - False for the selection tools, then only the reported parts are taken.
+        is_mask_changed = (
+            self.selected_mask_img is not self.history_mask_img
+            or self.composer.mask_generation != self.history_mask_generation
+        )
+        image_boxes = self.history_dirty_rects
+        if is_image_changed and not image_boxes:
+            image_boxes = None
+        is_recorded = self.history.record(self.image, image_boxes, self.selected_mask_img, is_mask_changed)
+        self.history_dirty_rects = []
+        self.history_mask_img = self.selected_mask_img
+        self.history_mask_generation = self.composer.mask_generation
+        if not is_recorded:
+            return
+        self.history_changed()
+
+        if self.history.entries[-1].kind == "mask":
+            return
         if self.autosave_var.get() and self.current_file is not None:
             self.save_current(autosave=True)
 
+    @contextmanager
+    def masked_edit(self, box):
+        # Yield the image for the tool to draw on and its offset (x, y) in the picture.
+        # Without the selection, it's the picture itself. With the selection, only the part of the picture
+        #   under the box (left, top, right, bottom) is copied, and it's pasted back through the same part
+        #   of the mask.
+        if self.selected_mask_img is None:
+            yield self.image, 0, 0
+            return
+
+        x1 = max(0, int(box[0]))
+        y1 = max(0, int(box[1]))
+        x2 = max(x1, min(self.image.width, int(box[2])))
+        y2 = max(y1, min(self.image.height, int(box[3])))
+
+        region = self.image.crop((x1, y1, x2, y2))
+        yield region, x1, y1
+
+        if x1 < x2 and y1 < y2:
+            self.image.paste(region, (x1, y1), self.selected_mask_img.crop((x1, y1, x2, y2)))
+
+    def get_brush_spacing(self):
+        # Distance between the dabs of the brush in pixels.
+        return max(1, self.tool_size * self.brush_spacing / 100)
+
     def draw_line(self, x1, y1, x2, y2):
         color = self.get_tool_main_color()
+        dirty_rect = bh_line_bbox(x1, y1, x2, y2, self.tool_size)
+
+        with self.masked_edit(dirty_rect) as (image, ox, oy):
+            bh_draw_line(
+                self.draw if image is self.image else ImageDraw.Draw(image),
+                x1 - ox,
+                y1 - oy,
+                x2 - ox,
+                y2 - oy,
+                color,
+                self.tool_size,
+                self.brush_shape,
+                self.current_tool,
+                self.get_brush_spacing(),
+            )
 
-        if self.selected_mask_img is None:
-            bh_draw_line(self.draw, x1, y1, x2, y2, color, self.tool_size, self.brush_shape, self.current_tool)
-        else:
-            tmp_image = self.image.copy()
-            tmp_draw = ImageDraw.Draw(tmp_image)
-            bh_draw_line(tmp_draw, x1, y1, x2, y2, color, self.tool_size, self.brush_shape, self.current_tool)
-            self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
-            del tmp_image
+        # Addons draw by it without request_redraw, so the composer and the history are told here.
+        self.request_redraw(dirty_rect)
+        return dirty_rect
 
     def crop_picture(self, x1, y1, x2, y2, event=None):
         new_width = x2 - x1
@@ -110,7 +177,7 @@ class Common:
         self.selected_mask_img = None
 
         self.force_resize_canvas()
-        self.update_canvas()
+        self.request_redraw()
 
         self.record_action()
 
@@ -180,6 +247,7 @@ class Common:
 
         self.image = Image.new(mode, (640, 480), color)
         self.saved_copy = self.image.copy()
+        self.clear_history()
         self.draw = ImageDraw.Draw(self.image)
         self.ui.canvas.xview_moveto(0)
         self.ui.canvas.yview_moveto(0)
@@ -193,38 +261,51 @@ class Common:
         self.selected_mask_img = None
 
         self.force_resize_canvas()
-        self.update_canvas()
+        self.request_redraw()
 
         self.record_action()
         self.ui.title(_("Unnamed") + " - " + _("Brushshe"))
         self.current_file = None
 
-    # TODO: Add selected_mask_img on history with type `mask`.
-    # FIXME: Need add length synchronization undo_stack and redo_stack (actually it must be one stack).
     def undo(self):
-        if len(self.undo_stack) > 1:
-            tmp_image = self.undo_stack.pop()
-            self.redo_stack.append(tmp_image)
-            self.image = self.undo_stack[-1].copy()
-            self.draw = ImageDraw.Draw(self.image)
-            if self.image.width != tmp_image.width or self.image.height != tmp_image.height:
-                self.selected_mask_img = None
-                self.force_resize_canvas()
-            self.update_canvas()
+        change = self.history.undo()
+        if change is not None:
+            self.apply_history_change(change)
 
     def redo(self):
-        if len(self.redo_stack) > 0:
-            tmp_image = self.redo_stack.pop().copy()
-            is_resize = False
-            if self.image.width != tmp_image.width or self.image.height != tmp_image.height:
-                is_resize = True
-            self.image = tmp_image
-            self.record_action()
+        change = self.history.redo()
+        if change is not None:
+            self.apply_history_change(change)
+
+    def jump_history(self, index):
+        if index != self.history.cursor:
+            self.apply_history_change(self.history.jump(index))
+
+    def apply_history_change(self, change):
+        # Set the picture and the mask to the current state of the history.
+        image = self.history.get_image()
+        if change.image_keys is None:
+            self.image = image.to_image()
             self.draw = ImageDraw.Draw(self.image)
-            if is_resize:
-                self.selected_mask_img = None
-                self.force_resize_canvas()
-            self.update_canvas()
+            self.force_resize_canvas()
+            self.request_redraw()
+        else:
+            # Only the changed tiles are pasted to the picture.
+            for key in change.image_keys:
+                box = image.get_tile_box(*key)
+                self.image.paste(image.tiles[key], box[:2])
+                self.request_redraw(box)
+
+        if change.is_mask_changed or change.image_keys is None:
+            mask = self.history.get_mask()
+            self.selected_mask_img = None if mask is None else mask.to_image()
+            self.request_redraw()
+
+        self._sync_composer()
+        self.history_dirty_rects = []
+        self.history_mask_img = self.selected_mask_img
+        self.history_mask_generation = self.composer.mask_generation
+        self.history_changed()
 
     def save_to_gallery(self):
         file_path = Constants.GALLERY_FOLDER / f"{uuid4()}.png"
@@ -278,9 +359,8 @@ class Common:
             self.bg_color = "white"
             self.image = Image.open(openimage)
             self.saved_copy = self.image.copy()
-            self.picture_postconfigure()
-
             self.selected_mask_img = None
+            self.picture_postconfigure()
 
             if not isinstance(openimage, BytesIO):
                 self.current_file = openimage
@@ -294,6 +374,8 @@ class Common:
     def rotate(self, degree):
         rotated_image = self.image.rotate(degree, expand=True)
         self.image = rotated_image
+        if self.selected_mask_img is not None:
+            self.selected_mask_img = self.selected_mask_img.rotate(degree, expand=True)
         self.picture_postconfigure()
 
     def remove_white_background(self):
@@ -314,13 +396,17 @@ class Common:
     def picture_postconfigure(self):
         self.ui.canvas.delete("tools")
 
+        # The selection of the other size doesn't match the new picture.
+        if self.selected_mask_img is not None and self.selected_mask_img.size != self.image.size:
+            self.selected_mask_img = None
+
         self.draw = ImageDraw.Draw(self.image)
 
         self.ui.canvas.xview_moveto(0)
         self.ui.canvas.yview_moveto(0)
 
         self.force_resize_canvas()
-        self.update_canvas()
+        self.request_redraw()
 
         self.record_action()
 
@@ -335,6 +421,7 @@ class Common:
             pasted_img = ImageGrab.grabclipboard()
             self.bg_color = "white"
             self.image = pasted_img
+            self.selected_mask_img = None
             self.picture_postconfigure()
         except Exception as e:
             messagebox.paste_error(e)
@@ -396,7 +483,7 @@ class Common:
                 self.draw = ImageDraw.Draw(self.image)
             else:
                 self.image.paste(result, (0, 0), self.selected_mask_img)
-            self.update_canvas()
+            self.request_redraw()
             self.record_action()
 
         effect_value = self.effects_optionmenu.get()
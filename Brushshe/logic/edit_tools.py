@@ -45,9 +45,12 @@ class EditTools:
             tmp_img = Image.new(self.image.mode, (self.image.width, self.image.height), bg_color)
             self.image.paste(tmp_img, (0, 0), tmp_img_mask)
             del tmp_img
+            dirty_rect = tmp_img_mask.getbbox()
+            if dirty_rect is not None:
+                self.request_redraw(dirty_rect)
             self.record_action()
-
-        self.update_canvas()
+        else:
+            self.request_redraw(invalidate=False)
 
     def copy_simple(self, deleted=False):
         if deleted is False:
@@ -134,9 +137,11 @@ class EditTools:
                         fill="#00000000",
                         outline="#00000000",
                     )
+                self.request_redraw((x1, y1, x2 + 1, y2 + 1))
                 self.record_action()  # Need only for cut.
-
-            self.update_canvas()
+            else:
+                # Only the frame of the tool is removed.
+                self.request_redraw(invalidate=False)
 
         def draw_tool(x1, y1, x2, y2):
             self.ui.canvas.delete("tools")
@@ -174,15 +179,15 @@ class EditTools:
         self.insert_simple(self.buffer_local)
 
     def insert_simple(self, insert_image=None):
-        image_tmp = insert_image
-        current_zoom = None
-        image_tmp_view = None
+        image_tmp = None
+        image_tmp_key = None
         image_tk = None
+        preview_key = None
+        preview_items = None
+        insert_proxy = None
         x1, y1 = None, None
 
-        def move(event):
-            nonlocal image_tmp, image_tmp_view, image_tk, current_zoom, x1, y1
-
+        def get_insert_size():
             if self.current_tool == "sticker":
                 it_width = self.tool_size
                 it_height = int(insert_image.height * self.tool_size / insert_image.width)
@@ -196,7 +201,41 @@ class EditTools:
                     resampling = Image.NEAREST
                 else:
                     resampling = Image.BICUBIC
-            image_tmp = insert_image.resize((it_width, it_height), resampling)
+            return it_width, it_height, resampling
+
+        def get_preview(it_width, it_height, resampling):
+            # The preview is made from the downscaled copy of the big image, if the view is not bigger than it.
+            nonlocal insert_proxy
+
+            view_size = (max(1, int(it_width * self.zoom)), max(1, int(it_height * self.zoom)))
+
+            proxy_limit = 1024
+            if insert_proxy is None:
+                scale = proxy_limit / max(insert_image.width, insert_image.height)
+                if scale < 1:
+                    proxy_size = (max(1, int(insert_image.width * scale)), max(1, int(insert_image.height * scale)))
+                    insert_proxy = insert_image.resize(proxy_size, Image.BOX)
+                else:
+                    insert_proxy = insert_image
+
+            if insert_proxy is not insert_image and view_size[0] <= insert_proxy.width:
+                return insert_proxy.resize(view_size, resampling)
+            return get_image_tmp(it_width, it_height, resampling).resize(view_size, Image.BOX)
+
+        def get_image_tmp(it_width, it_height, resampling):
+            # The inserted image of the tool size, it's resized only when the size is changed.
+            nonlocal image_tmp, image_tmp_key
+
+            key = (it_width, it_height, resampling)
+            if key != image_tmp_key:
+                image_tmp = insert_image.resize((it_width, it_height), resampling)
+                image_tmp_key = key
+            return image_tmp
+
+        def move(event):
+            nonlocal image_tk, preview_key, x1, y1
+
+            it_width, it_height, resampling = get_insert_size()
 
             x, y = self.canvas_to_pict_xy(event.x, event.y)
 
@@ -205,35 +244,39 @@ class EditTools:
             x2 = int(x1 + it_width - 1)
             y2 = int(y1 + it_height - 1)
 
-            image_tmp_view = image_tmp.resize((int(it_width * self.zoom), int(it_height * self.zoom)), Image.BOX)
-            image_tk = ImageTk.PhotoImage(image_tmp_view)
-            current_zoom = self.zoom
+            # Only the position is changed usually, then the items of the canvas are moved.
+            key = (it_width, it_height, resampling, self.zoom)
+            if key == preview_key and preview_items is not None and self.ui.canvas.coords(preview_items[0]):
+                move_tool(x1, y1, x2, y2)
+                return
+
+            image_tk = ImageTk.PhotoImage(get_preview(it_width, it_height, resampling))
+            preview_key = key
 
             draw_tool(x1, y1, x2, y2)
 
         def insert_end(event):
-            nonlocal image_tmp, x1, y1
-
             if x1 is None or y1 is None:
                 return
 
-            if image_tmp.mode == "RGBA":
-                self.image.paste(image_tmp, (x1, y1), image_tmp)
+            image = get_image_tmp(*get_insert_size())
+            if image.mode == "RGBA":
+                self.image.paste(image, (x1, y1), image)
             else:
-                self.image.paste(image_tmp, (x1, y1))
+                self.image.paste(image, (x1, y1))
 
-            self.update_canvas()
+            self.request_redraw((x1, y1, x1 + image.width, y1 + image.height))
             self.record_action()
 
         def leave(event):
             self.ui.canvas.delete("tools")
 
         def draw_tool(x1, y1, x2, y2):
-            nonlocal image_tk
+            nonlocal preview_items
 
             self.ui.canvas.delete("tools")
 
-            self.ui.canvas.create_image(
+            image_item = self.ui.canvas.create_image(
                 int(x1 * self.zoom),
                 int(y1 * self.zoom),
                 image=image_tk,
@@ -241,7 +284,7 @@ class EditTools:
                 anchor="nw",
             )
 
-            self.ui.canvas.create_rectangle(
+            white_item = self.ui.canvas.create_rectangle(
                 int(x1 * self.zoom),
                 int(y1 * self.zoom),
                 int((x2 + 1) * self.zoom - 1),
@@ -250,7 +293,7 @@ class EditTools:
                 width=1,
                 tag="tools",
             )
-            self.ui.canvas.create_rectangle(
+            black_item = self.ui.canvas.create_rectangle(
                 int(x1 * self.zoom),
                 int(y1 * self.zoom),
                 int((x2 + 1) * self.zoom - 1),
@@ -260,6 +303,20 @@ class EditTools:
                 tag="tools",
                 dash=(5, 5),
             )
+            preview_items = (image_item, white_item, black_item)
+
+        def move_tool(x1, y1, x2, y2):
+            image_item, white_item, black_item = preview_items
+
+            self.ui.canvas.coords(image_item, int(x1 * self.zoom), int(y1 * self.zoom))
+            for item in (white_item, black_item):
+                self.ui.canvas.coords(
+                    item,
+                    int(x1 * self.zoom),
+                    int(y1 * self.zoom),
+                    int((x2 + 1) * self.zoom - 1),
+                    int((y2 + 1) * self.zoom - 1),
+                )
 
         self.ui.canvas.bind("<ButtonRelease-1>", insert_end)
         self.ui.canvas.bind("<Motion>", move)
@@ -337,7 +394,8 @@ class EditTools:
             # TODO: Continue...
             self.selected_mask_img = None
 
-            self.update_canvas()
+            # The picture is redrawn by crop_picture.
+            self.request_redraw(invalidate=False)
 
         def draw_tool(x1, y1, x2, y2):
             self.ui.canvas.delete("tools")
@@ -4,10 +4,13 @@
 
 import math
 import random
+import time
 
-from core.bhbrush import bh_draw_recoloring_line
+from core.bhbrush import bh_draw_recoloring_line, bh_get_spray_offsets, bh_line_bbox
 from core.bhhistory import BhHistory, BhPoint
-from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+from core.bhstroke import BhStrokeBuffer
+from core.bhtext import bh_get_font, bh_get_text_layout
+from PIL import Image, ImageChops, ImageColor, ImageDraw
 from utils import common
 from utils.translator import _
 
@@ -19,6 +22,7 @@ class PaintTools:
         prev_x = None
         prev_y = None
         point_history = None
+        preview_xy = None
 
         if type == "brush":
             self.set_tool("brush", "Brush", self.brush_size, 1, 50, "pencil")
@@ -29,37 +33,97 @@ class PaintTools:
             self.set_tool("brush", "Brush", self.brush_size, 1, 50, "pencil")
 
         def paint(event):
-            nonlocal prev_x, prev_y, point_history
+            self.queue_input(event, paint_samples, draw_preview(event))
 
-            if self.is_brush_smoothing is False:
-                x, y = self.canvas_to_pict_xy(event.x, event.y)
+        def draw_preview(event):
+            # The stroke is drawn on the picture once per frame, but the canvas line is shown right away.
+            nonlocal preview_xy
+
+            x, y = self.ui.canvas.canvasx(event.x), self.ui.canvas.canvasy(event.y)
+            width = max(1, self.tool_size * self.zoom)
+            if self.current_tool == "eraser":
+                color = self.bg_color if self.image.mode != "RGBA" else self.composer.background_color_1
             else:
-                if point_history is None:
-                    point_history = BhHistory(limit_length=self.brush_smoothing_factor)
-                xf, yf = self.canvas_to_pict_xy_f(event.x, event.y)
-                point_history.add_point(BhPoint(x=xf, y=yf, pressure=1.0))
-                s_point = point_history.get_smoothing_point(
-                    self.brush_smoothing_factor,
-                    self.brush_smoothing_quality,
+                color = self.brush_color
+
+            if preview_xy is None:
+                r = width / 2
+                if self.brush_shape == "circle":
+                    create_shape = self.ui.canvas.create_oval
+                else:
+                    create_shape = self.ui.canvas.create_rectangle
+                item = create_shape(x - r, y - r, x + r, y + r, fill=color, outline="", tag="stroke_preview")
+            else:
+                item = self.ui.canvas.create_line(
+                    *preview_xy,
+                    x,
+                    y,
+                    fill=color,
+                    width=width,
+                    capstyle="round" if self.brush_shape == "circle" else "projecting",
+                    tag="stroke_preview",
                 )
-                if s_point is not None:
-                    x = int(s_point.x)
-                    y = int(s_point.y)
+            self.ui.canvas.tag_raise("tools")
+            preview_xy = (x, y)
+            return item
+
+        def paint_samples(samples):
+            # All samples of the frame are drawn as one polyline.
+            nonlocal prev_x, prev_y, point_history
+
+            points = []
+            for xf, yf, event_time in samples:
+                if self.is_brush_smoothing is False:
+                    x, y = math.floor(xf), math.floor(yf)
                 else:
-                    x, y = self.canvas_to_pict_xy(event.x, event.y)
+                    if point_history is None:
+                        point_history = BhHistory(limit_length=self.brush_smoothing_factor)
+                    point_history.add_point(BhPoint(x=xf, y=yf, pressure=1.0, time=event_time))
+                    s_point = point_history.get_smoothing_point(
+                        self.brush_smoothing_factor,
+                        self.brush_smoothing_quality,
+                    )
+                    if s_point is not None:
+                        x = int(s_point.x)
+                        y = int(s_point.y)
+                    else:
+                        x, y = math.floor(xf), math.floor(yf)
+                points.append((x, y))
+
+            if prev_x is None or prev_y is None:
+                prev_x, prev_y = points[0]
+                if self.image.mode in BhStrokeBuffer.modes:
+                    opacity = self.brush_opacity * 255 // 100
+                    self.stroke = BhStrokeBuffer(self.image.size, self.get_tool_main_color(), opacity)
+
+            points.insert(0, (prev_x, prev_y))
 
-            if prev_x is not None and prev_y is not None:
-                self.draw_line(prev_x, prev_y, x, y)
+            if self.stroke is not None:
+                # The stroke is shown by the composer and put to the picture at the end of the stroke.
+                dirty_rect = self.stroke.draw_polyline(
+                    points, self.tool_size, self.brush_shape, self.current_tool, self.get_brush_spacing()
+                )
             else:
-                self.draw_line(x, y, x, y)
+                rects = [self.draw_line(*p1, *p2) for p1, p2 in zip(points, points[1:])]
+                dirty_rect = (
+                    min(r[0] for r in rects),
+                    min(r[1] for r in rects),
+                    max(r[2] for r in rects),
+                    max(r[3] for r in rects),
+                )
 
-            prev_x, prev_y = x, y
+            prev_x, prev_y = points[-1]
 
-            self.update_canvas()
-            draw_brush_halo(x, y)
+            self.request_redraw(dirty_rect)
+            draw_brush_halo(prev_x, prev_y)
+            return dirty_rect
 
         def stop_paint(event):
-            nonlocal prev_x, prev_y, point_history
+            nonlocal prev_x, prev_y, point_history, preview_xy
+
+            # Draw the samples, which are not drawn yet.
+            self.drain_input()
+            preview_xy = None
 
             if prev_x is None:
                 return
@@ -68,6 +132,12 @@ class PaintTools:
             x, y = self.canvas_to_pict_xy(event.x, event.y)
             draw_brush_halo(x, y)
 
+            if self.stroke is not None:
+                dirty_rect = self.stroke.commit(self.image, self.selected_mask_img)
+                self.stroke = None
+                if dirty_rect is not None:
+                    self.request_redraw(dirty_rect)
+
             point_history = None
             prev_x, prev_y = (None, None)
             self.record_action()
@@ -130,28 +200,39 @@ class PaintTools:
 
     def fill(self, event):
         x, y = self.canvas_to_pict_xy(event.x, event.y)
-        tmp_image = self.image if self.selected_mask_img is None else self.image.copy()
 
         if self.image.mode == "RGBA":
             fill_color = common.rgb_tuple_to_rgba_tuple(ImageColor.getrgb(self.brush_color), 255)
         else:
             fill_color = ImageColor.getrgb(self.brush_color)
 
-        if self.is_gradient_fill.get():
-            self.gradient_fill(x, y)
+        # With the selection, the fill can't go out of the selected part.
+        if self.selected_mask_img is None:
+            box = (0, 0, self.image.width, self.image.height)
         else:
-            ImageDraw.floodfill(tmp_image, (x, y), fill_color)
-            if self.selected_mask_img is not None:
-                self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
+            box = self.selected_mask_img.getbbox() or (0, 0, 0, 0)
+
+        with self.masked_edit(box) as (image, ox, oy):
+            before = image.copy()
+            if self.is_gradient_fill.get():
+                self.gradient_fill(image, x - ox, y - oy)
+            else:
+                ImageDraw.floodfill(image, (x - ox, y - oy), fill_color)
+            # Only the filled part is reported, so the history keeps only its tiles.
+            changed = ImageChops.difference(before, image).getbbox(alpha_only=False)
+            del before
 
-        self.update_canvas()
+        if changed is None:
+            return
+        dirty_rect = (changed[0] + ox, changed[1] + oy, changed[2] + ox, changed[3] + oy)
+        self.request_redraw(dirty_rect)
         self.record_action()
 
-    def gradient_fill(self, x, y):
+    def gradient_fill(self, image, x, y):
         def color_distance(c1, c2):
             return ((c1[0] - c2[0]) ** 2 + (c1[1] - c2[1]) ** 2 + (c1[2] - c2[2]) ** 2) ** 0.5
 
-        if not (0 <= x < self.image.width and 0 <= y < self.image.height):
+        if not (0 <= x < image.width and 0 <= y < image.height):
             return
 
         start_color = ImageColor.getrgb(self.brush_color)
@@ -159,15 +240,15 @@ class PaintTools:
         threshold = 50
         direction = self.gradient_mode_optionmenu.get()
 
-        temp = self.image.copy()
+        temp = image.copy()
 
-        fill_color = (255, 0, 255, 255) if self.image.mode == "RGBA" else (255, 0, 255)
+        fill_color = (255, 0, 255, 255) if image.mode == "RGBA" else (255, 0, 255)
         try:
             ImageDraw.floodfill(temp, (x, y), fill_color, thresh=threshold)
         except Exception:
             return
 
-        diff = ImageChops.difference(self.image.convert("RGB"), temp.convert("RGB"))
+        diff = ImageChops.difference(image.convert("RGB"), temp.convert("RGB"))
         mask = diff.convert("L").point(lambda p: 255 if p != 0 else 0)
 
         bbox = mask.getbbox()
@@ -175,7 +256,7 @@ class PaintTools:
             return
         min_x, min_y, max_x, max_y = bbox
 
-        gradient = Image.new(self.image.mode, self.image.size)
+        gradient = Image.new(image.mode, image.size)
         for j in range(min_y, max_y + 1):
             for i in range(min_x, max_x + 1):
                 if 0 <= i < mask.width and 0 <= j < mask.height and mask.getpixel((i, j)) == 255:
@@ -201,17 +282,12 @@ class PaintTools:
                     g = int(start_color[1] + (end_color[1] - start_color[1]) * ratio)
                     b = int(start_color[2] + (end_color[2] - start_color[2]) * ratio)
 
-                    if self.image.mode == "RGBA":
+                    if image.mode == "RGBA":
                         gradient.putpixel((i, j), (r, g, b, 255))
                     else:
                         gradient.putpixel((i, j), (r, g, b))
 
-        filled = Image.composite(gradient, self.image, mask)
-
-        if self.selected_mask_img is None:
-            self.image.paste(filled)
-        else:
-            self.image.paste(filled, (0, 0), self.selected_mask_img)
+        image.paste(gradient, (0, 0), mask)
 
     """Recoloring brush"""
 
@@ -231,7 +307,7 @@ class PaintTools:
                 if point_history is None:
                     point_history = BhHistory(limit_length=self.brush_smoothing_factor)
                 xf, yf = self.canvas_to_pict_xy_f(event.x, event.y)
-                point_history.add_point(BhPoint(x=xf, y=yf, pressure=1.0))
+                point_history.add_point(BhPoint(x=xf, y=yf, pressure=1.0, time=event.time))
                 s_point = point_history.get_smoothing_point(
                     self.brush_smoothing_factor,
                     self.brush_smoothing_quality,
@@ -246,9 +322,10 @@ class PaintTools:
                 prev_x, prev_y = x, y
 
             draw_recoloring_brush(x, y, prev_x, prev_y)
+            dirty_rect = bh_line_bbox(x, y, prev_x, prev_y, self.tool_size)
             prev_x, prev_y = x, y
 
-            self.update_canvas()  # force=False  # Do not delete tools shapes.
+            self.request_redraw(dirty_rect)  # force=False  # Do not delete tools shapes.
             draw_brush_halo(x, y)
 
         def end(event):
@@ -278,13 +355,10 @@ class PaintTools:
                 color_from = common.rgb_tuple_to_rgba_tuple(color_from, 255)
                 color_to = common.rgb_tuple_to_rgba_tuple(color_to, 255)
 
-            if self.selected_mask_img is None:
-                bh_draw_recoloring_line(self.image, x1, y1, x2, y2, color_from, color_to, self.tool_size)
-            else:
-                tmp_image = self.image.copy()
-                bh_draw_recoloring_line(tmp_image, x1, y1, x2, y2, color_from, color_to, self.tool_size)
-                self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
-                del tmp_image
+            with self.masked_edit(bh_line_bbox(x1, y1, x2, y2, self.tool_size)) as (image, ox, oy):
+                bh_draw_recoloring_line(
+                    image, x1 - ox, y1 - oy, x2 - ox, y2 - oy, color_from, color_to, self.tool_size, self.brush_shape
+                )
 
         def draw_brush_halo(x, y):
             self.ui.canvas.delete("tools")
@@ -292,7 +366,12 @@ class PaintTools:
             d1 = (self.tool_size - 1) // 2
             d2 = self.tool_size // 2
 
-            self.ui.canvas.create_rectangle(
+            if self.brush_shape == "circle":
+                canvas_create_shape = self.ui.canvas.create_oval
+            else:
+                canvas_create_shape = self.ui.canvas.create_rectangle
+
+            canvas_create_shape(
                 int((x - d1) * self.zoom - 1),
                 int((y - d1) * self.zoom - 1),
                 int((x + d2 + 1) * self.zoom),
@@ -301,7 +380,7 @@ class PaintTools:
                 width=1,
                 tag="tools",
             )
-            self.ui.canvas.create_rectangle(
+            canvas_create_shape(
                 int((x - d1) * self.zoom),
                 int((y - d1) * self.zoom),
                 int((x + d2 + 1) * self.zoom - 1),
@@ -323,36 +402,53 @@ class PaintTools:
     """Spray"""
 
     def spray(self):
+        # Dots per second for the radius 1. The same count as the old 2 * size dots every 50 ms.
+        dots_rate = 2 * 1000 / 50
+        spray_time = None
+        dots_rest = 0.0
+
         def start_spray(event):
+            nonlocal spray_time, dots_rest
             self.prev_x, self.prev_y = self.canvas_to_pict_xy(event.x, event.y)
             self.spraying = True
+            # The first tick has the dots of one interval.
+            spray_time = time.perf_counter() - 0.05
+            dots_rest = 0.0
             do_spray()
 
         def do_spray():
+            nonlocal spray_time, dots_rest
             if not self.spraying or self.prev_x is None or self.prev_y is None:
                 return
 
-            if self.selected_mask_img is None:
-                tmp_image = self.image
-                tmp_draw = ImageDraw.Draw(tmp_image)
-            else:
-                tmp_image = self.image.copy()
-                tmp_draw = ImageDraw.Draw(tmp_image)
-
-            for i in range(self.tool_size * 2):
-                offset_x = random.randint(-self.tool_size, self.tool_size)
-                offset_y = random.randint(-self.tool_size, self.tool_size)
-                if offset_x**2 + offset_y**2 <= self.tool_size**2:
-                    tmp_draw.point((self.prev_x + offset_x, self.prev_y + offset_y), fill=self.brush_color)
+            # Count of the dots depends on the time, not on the count of the ticks.
+            now = time.perf_counter()
+            elapsed = min(now - spray_time, 0.25)
+            spray_time = now
+
+            size = self.tool_size
+            offsets = bh_get_spray_offsets(size)
+            # Part of the random points of the square, which are inside the circle.
+            dots_rest += elapsed * dots_rate * size * len(offsets) / (2 * size + 1) ** 2
+            count = int(dots_rest)
+            dots_rest -= count
+
+            dirty_rect = (
+                self.prev_x - size,
+                self.prev_y - size,
+                self.prev_x + size + 1,
+                self.prev_y + size + 1,
+            )
 
-            if self.selected_mask_img is None:
-                pass
-            else:
-                self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
+            if count > 0:
+                with self.masked_edit(dirty_rect) as (image, ox, oy):
+                    x = self.prev_x - ox
+                    y = self.prev_y - oy
+                    points = [(x + dx, y + dy) for dx, dy in random.choices(offsets, k=count)]
+                    ImageDraw.Draw(image).point(points, fill=self.brush_color)
 
-            del tmp_image
+                self.request_redraw(dirty_rect)
 
-            self.update_canvas()
             self.spray_job = self.ui.after(50, do_spray)
 
         def move_spray(event):
@@ -378,17 +474,38 @@ class PaintTools:
 
     def text_tool(self):
         def add_text(event):
-            self.draw.text((self.text_x, self.text_y), self.tx_entry.get(), fill=self.brush_color, font=self.imagefont)
-            self.update_canvas()
+            draw_text_halo(event)
+            if self.stroke is not None:
+                dirty_rect = self.stroke.commit(self.image, self.selected_mask_img)
+                self.stroke = None
+            elif self.tx_entry.get() != "":
+                # The picture mode without the stroke (for example "P").
+                bbox = self.draw.textbbox((self.text_x, self.text_y), self.tx_entry.get(), font=self.imagefont)
+                dirty_rect = (bbox[0], bbox[1], bbox[2], bbox[3])
+                with self.masked_edit(dirty_rect) as (image, ox, oy):
+                    ImageDraw.Draw(image).text(
+                        (self.text_x - ox, self.text_y - oy),
+                        self.tx_entry.get(),
+                        fill=self.brush_color,
+                        font=self.imagefont,
+                    )
+            else:
+                return
+            self.request_redraw(dirty_rect)
             self.record_action()
 
         def draw_text_halo(event):
             self.ui.canvas.delete("tools")
 
             x, y = self.canvas_to_pict_xy(event.x, event.y)
-            self.imagefont = ImageFont.truetype(self.font_path, self.tool_size)
+            self.imagefont = bh_get_font(self.font_path, self.tool_size)
 
-            bbox = self.draw.textbbox((0, 0), self.tx_entry.get(), font=self.imagefont)
+            text = self.tx_entry.get()
+            if text == "":
+                clear_preview()
+                return
+
+            bbox, coverage = bh_get_text_layout(text, self.imagefont)
 
             text_width = bbox[2] - bbox[0]
             text_height = bbox[3] - bbox[1]
@@ -396,6 +513,18 @@ class PaintTools:
             self.text_x = x - text_width // 2 - bbox[0]
             self.text_y = y - text_height // 2 - bbox[1]
 
+            # The text is shown by the composer as the stroke, which is moved with the cursor.
+            #   It's put to the picture on click. In other modes only the frame of the text is shown.
+            if self.image.mode in BhStrokeBuffer.modes:
+                if self.stroke is None:
+                    self.stroke = BhStrokeBuffer(self.image.size, self.brush_color)
+                self.stroke.color = self.brush_color
+                old_box, new_box = self.stroke.set_coverage(coverage, x - text_width // 2, y - text_height // 2)
+                if old_box != new_box:
+                    if old_box is not None:
+                        self.request_redraw(old_box, document=False)
+                    self.request_redraw(new_box, document=False)
+
             self.ui.canvas.create_rectangle(
                 (x - text_width // 2) * self.zoom,
                 (y - text_height // 2) * self.zoom,
@@ -417,8 +546,16 @@ class PaintTools:
                 dash=(5, 5),
             )
 
+        def clear_preview():
+            if self.stroke is not None:
+                box = self.stroke.box
+                self.stroke = None
+                if box is not None:
+                    self.request_redraw(box, document=False)
+
         def leave(event):
             self.ui.canvas.delete("tools")
+            clear_preview()
 
         self.set_tool("text", "Text", self.font_size, 11, 96, "cross")
         self.ui.canvas.bind("<Button-1>", add_text)
@@ -104,6 +104,7 @@ class Screenshot:
     def create_screenshot(self):
         def ready_screenshot(screenshot_img):
             self.image = screenshot_img.copy()
+            self.selected_mask_img = None
             self.picture_postconfigure()
             screenshot_window.destroy()
             self.ui.deiconify()
@@ -2,8 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import time
-
+from core.bhoutline import bh_mask_outline
 from PIL import Image, ImageDraw, ImageOps
 from utils import common
 
@@ -93,7 +92,8 @@ class Selection:
                 draw.rectangle([x1, y1, x2, y2], fill="white")
 
             self.composer.set_force_update_mask()
-            self.update_canvas()
+            self.request_redraw(invalidate=False)
+            self.record_action(is_image_changed=False)
 
         def draw_tool(x1, y1, x2, y2):
             self.ui.canvas.delete("tools")
@@ -201,7 +201,8 @@ class Selection:
             xy_list = None
 
             self.composer.set_force_update_mask()
-            self.update_canvas()
+            self.request_redraw(invalidate=False)
+            self.record_action(is_image_changed=False)
 
         def key_backspace(event):
             nonlocal xy_list
@@ -347,7 +348,8 @@ class Selection:
                 self._floodfill_mask(self.image, self.selected_mask_img, (x, y), fill_color)
 
             self.composer.set_force_update_mask()
-            self.update_canvas()
+            self.request_redraw(invalidate=False)
+            self.record_action(is_image_changed=False)
 
         self.ui.canvas.bind("<Button-1>", lambda e: selecting(e, "replace"))
         self.ui.canvas.bind("<Shift-Button-1>", lambda e: selecting(e, "add"))
@@ -361,7 +363,8 @@ class Selection:
         del tmp_mask_img
 
         self.composer.set_force_update_mask()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
+        self.record_action(is_image_changed=False)
 
     def select_all_mask(self):
         self.select_init_mask()
@@ -372,7 +375,8 @@ class Selection:
         draw.rectangle([0, 0, x_max, y_max], fill=255)
 
         self.composer.set_force_update_mask()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
+        self.record_action(is_image_changed=False)
 
     def select_init_mask(self):
         if self.composer is None:
@@ -388,32 +392,57 @@ class Selection:
         self.composer.mask_img = None
 
         self.composer.set_force_update_mask()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
+        self.record_action(is_image_changed=False)
 
     # Timer for musk
     def mask_update(self):
-        mm_time = int(time.time() * 1000)
-
-        if (
-            self.composer.mask_type != 0
-            and self.selected_mask_img is not None
-            and self.timer_mask_last_update + 500 < mm_time
-        ):
-            # self.timer_mask_last_update = mm_time
-
-            self.composer.inc_ants_position()
-            self.update_canvas()
-            # print("DEBUG: ants update: {}".format(mm_time))
+        if self.ants_loops is not None:
+            # Only move the dashes, no raster work.
+            self.ants_offset = (self.ants_offset + 2) % 10
+            self.ui.canvas.itemconfig("ants_dash", dashoffset=self.ants_offset)
 
         # Repeat timer
         self.timer_mask_update = self.ui.after(self.timer_mask_time_for_update, self.mask_update)
 
+    def update_ants(self):
+        # Draw the outline of the selection. It is extracted again only when the mask is changed.
+        if self.composer.mask_type == 0 or self.selected_mask_img is None:
+            if self.ants_loops is not None:
+                self.ui.canvas.delete("ants")
+                self.ants_loops = None
+                self.ants_state = None
+            return
+
+        state = (self.composer.mask_generation, self.zoom)
+        if state == self.ants_state:
+            return
+
+        if self.ants_loops is None or self.ants_state[0] != state[0]:
+            self.ants_loops = bh_mask_outline(self.selected_mask_img)
+        self.ants_state = state
+
+        # The right and bottom edges of the picture are moved to the last canvas pixel to be visible.
+        cw_max = int(self.image.width * self.zoom) - 1
+        ch_max = int(self.image.height * self.zoom) - 1
+
+        self.ui.canvas.delete("ants")
+        for loop in self.ants_loops:
+            coords = []
+            for i in range(0, len(loop), 2):
+                coords.append(min(int(loop[i] * self.zoom), cw_max))
+                coords.append(min(int(loop[i + 1] * self.zoom), ch_max))
+            self.ui.canvas.create_line(coords, fill="white", width=1, tag="ants")
+            self.ui.canvas.create_line(
+                coords, fill="black", width=1, tag=("ants", "ants_dash"), dash=(5, 5), dashoffset=self.ants_offset
+            )
+        self.ui.canvas.tag_raise("tools")
+
     def set_mask_type(self, type: int = 0):
         self.composer.mask_type = type
-        # self.timer_mask_last_update = int(time.time() * 1000)
 
         self.composer.set_force_update_mask()
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
 
     def delete_selected(self):
         if self.selected_mask_img is None:
@@ -426,7 +455,7 @@ class Selection:
         self.image.paste(tmp_img, (0, 0), self.selected_mask_img)
         del tmp_img
         self.record_action()
-        self.update_canvas()
+        self.request_redraw()
 
     def _floodfill_mask(
         self,
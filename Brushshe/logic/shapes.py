@@ -3,7 +3,7 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 from core.bezier import make_bezier
-from core.bhbrush import bh_draw_line
+from core.bhbrush import bh_draw_segment, bh_segment_bbox
 from PIL import ImageDraw
 
 
@@ -56,37 +56,33 @@ class Shapes:
             else:
                 y0, y1 = y_end, y_begin
 
-            if self.selected_mask_img is None:
-                tmp_draw = ImageDraw.Draw(self.image)
-            else:
-                tmp_image = self.image.copy()
-                tmp_draw = ImageDraw.Draw(tmp_image)
-
             color = self.get_tool_main_color()
-
-            if shape == "Rectangle":
-                tmp_draw.rectangle([x0, y0, x1, y1], outline=self.brush_color, width=self.tool_size)
-            elif shape == "Oval":
-                tmp_draw.ellipse([x0, y0, x1, y1], outline=self.brush_color, width=self.tool_size)
-            elif shape == "Line":
-                # self.draw_line(x_begin, y_begin, x_end, y_end)
-                bh_draw_line(
-                    tmp_draw, x_begin, y_begin, x_end, y_end, color, self.tool_size, self.brush_shape, self.current_tool
-                )
-            elif shape == "Fill rectangle":
-                tmp_draw.rectangle([x0, y0, x1, y1], fill=self.brush_color)
-            elif shape == "Fill oval":
-                tmp_draw.ellipse([x0, y0, x1, y1], fill=self.brush_color)
-            else:
-                print("Warning: Incorrect shape.")
-
-            if self.selected_mask_img is None:
-                pass
+            if shape == "Line":
+                dirty_rect = bh_segment_bbox(x_begin, y_begin, x_end, y_end, self.tool_size)
             else:
-                self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
-                del tmp_image
+                dirty_rect = (x0, y0, x1 + 1, y1 + 1)
+
+            with self.masked_edit(dirty_rect) as (image, ox, oy):
+                tmp_draw = ImageDraw.Draw(image)
+                box = [x0 - ox, y0 - oy, x1 - ox, y1 - oy]
+
+                if shape == "Rectangle":
+                    tmp_draw.rectangle(box, outline=self.brush_color, width=self.tool_size)
+                elif shape == "Oval":
+                    tmp_draw.ellipse(box, outline=self.brush_color, width=self.tool_size)
+                elif shape == "Line":
+                    # Shapes are drawn by the round brush.
+                    bh_draw_segment(
+                        tmp_draw, x_begin - ox, y_begin - oy, x_end - ox, y_end - oy, color, self.tool_size, "circle"
+                    )
+                elif shape == "Fill rectangle":
+                    tmp_draw.rectangle(box, fill=self.brush_color)
+                elif shape == "Fill oval":
+                    tmp_draw.ellipse(box, fill=self.brush_color)
+                else:
+                    print("Warning: Incorrect shape.")
 
-            self.update_canvas()
+            self.request_redraw(dirty_rect)
             self.record_action()
 
             # Removing unnecessary variables for normal selection of the next shape in the menu
@@ -111,7 +107,7 @@ class Shapes:
         bezier_id = None
 
         # Clear canvas.
-        self.update_canvas()
+        self.request_redraw(invalidate=False)
 
         def start(event):
             nonlocal canvas_points, image_points, bezier_id
@@ -203,35 +199,26 @@ class Shapes:
 
                 color = self.get_tool_main_color()
 
-                if self.selected_mask_img is None:
-                    tmp_image = self.image
-                    tmp_draw = ImageDraw.Draw(tmp_image)
-                else:
-                    tmp_image = self.image.copy()
-                    tmp_draw = ImageDraw.Draw(tmp_image)
+                xs = [int(p[0]) for p in points]
+                ys = [int(p[1]) for p in points]
+                dirty_rect = bh_segment_bbox(min(xs), min(ys), max(xs), max(ys), self.tool_size)
 
-                for it, tt in enumerate(points):
-                    if it < points_len - 1:
-                        bh_draw_line(
+                with self.masked_edit(dirty_rect) as (image, ox, oy):
+                    tmp_draw = ImageDraw.Draw(image)
+                    for it in range(points_len - 1):
+                        bh_draw_segment(
                             tmp_draw,
-                            int(points[it][0]),
-                            int(points[it][1]),
-                            int(points[it + 1][0]),
-                            int(points[it + 1][1]),
+                            xs[it] - ox,
+                            ys[it] - oy,
+                            xs[it + 1] - ox,
+                            ys[it + 1] - oy,
                             color,
                             self.tool_size,
-                            self.brush_shape,
-                            self.current_tool,
+                            "circle",
                         )
 
-                if self.selected_mask_img is None:
-                    pass
-                else:
-                    self.image.paste(tmp_image, (0, 0), self.selected_mask_img)
-                    del tmp_image
-
                 self.ui.canvas.delete(bezier_id)
-                self.update_canvas()
+                self.request_redraw(dirty_rect)
                 self.record_action()
 
                 # Reset nonlocal variables.
@@ -4,7 +4,7 @@
 
 import customtkinter as ctk
 from constants import Constants
-from PIL import ImageFont
+from core.bhtext import bh_get_font
 from ui.tooltip import Tooltip
 from utils.common import resource
 from utils.translator import _
@@ -60,6 +60,13 @@ class ToolOperations:
         self.ui.canvas.unbind("<BackSpace>")
         self.ui.canvas.unbind("<Return>")
 
+        if self.stroke is not None:
+            # The preview of the previous tool (the text), which is not put to the picture.
+            box = self.stroke.box
+            self.stroke = None
+            if box is not None:
+                self.request_redraw(box, document=False)
+
         for child in self.ui.tool_config_docker.winfo_children():
             child.destroy()
 
@@ -95,9 +102,9 @@ class ToolOperations:
         def font_optionmenu_callback(value):
             self.current_font = value
             self.font_path = resource(Constants.FONTS_DICT.get(value))
-            self.imagefont = ImageFont.truetype(self.font_path, self.tool_size)
+            self.imagefont = bh_get_font(self.font_path, self.tool_size)
 
-        if self.current_tool in ["brush", "eraser"]:
+        if self.current_tool in ["brush", "eraser", "r-brush"]:
             brush_shape_btn = ctk.CTkSegmentedButton(
                 self.ui.tool_config_docker, values=["●", "■"], command=brush_shape_btn_callback
             )
@@ -88,6 +88,11 @@ def set_image_to_cache(cache_folder, image, name, size, mtime, suffix):
         print("Warning: cached file can't be saved")
 
 
+def get_history_journal_path():
+    # Own journal for each running app.
+    return os.path.normpath(user_cache_dir("brushshe") + f"/history/{os.getpid()}.journal")
+
+
 def clear_gallery_thumbs_cache():
     cache_folder = user_cache_dir("brushshe")
 
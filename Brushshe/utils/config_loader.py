@@ -17,16 +17,21 @@ def load_config():
 
     default_options = {
         "theme": "System",
-        "undo_levels": "10",
+        "history_size": "256",
+        "history_disk_size": "4096",
         "smoothing": "False",
         "brush_smoothing_factor": "10",
         "brush_smoothing_quality": "20",
+        "brush_opacity": "100",
+        "brush_spacing": "10",
         "mask": "0",
         "palette": "default",
         "autosave": "False",
         "color_theme": "brushshe_theme",
         "language": "None",
         "left_toolbar_config": "default",
+        "render_cache_size": "64",
+        "render_margin": "1",
     }
 
     if not config.has_section("Brushshe"):
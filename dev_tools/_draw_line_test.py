@@ -0,0 +1,53 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# The line of the addon API (Common.draw_line) must be shown by the composer and taken by the history.
+# Run from the dev_tools folder: python _draw_line_test.py
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Brushshe"))
+
+from core.bhcomposer import BhComposer  # noqa: E402
+from logic.canvas import CanvasOperations  # noqa: E402
+from logic.common import Common  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+
+class Logic(Common, CanvasOperations):
+    def __init__(self):
+        self.ui = SimpleNamespace(after=lambda delay, callback: "job", after_idle=lambda callback: "job")
+        self.image = Image.new("RGB", (600, 400), "white")
+        self.draw = ImageDraw.Draw(self.image)
+        self.selected_mask_img = None
+        self.stroke = None
+        self.zoom = 1
+        self.composer = BhComposer(*self.image.size)
+        self.history_dirty_rects = []
+        self.redraw_interval = 16
+        self.redraw_job = None
+        self.redraw_full = False
+        self.redraw_last_time = 0
+        self.current_tool = "brush"
+        self.brush_color = "#ff0000"
+        self.brush_shape = "circle"
+        self.brush_spacing = 0
+        self.tool_size = 10
+
+
+logic = Logic()
+logic._sync_composer()
+tile_before = logic.composer.get_tile_image(0, 0)
+
+rect = logic.draw_line(20, 20, 200, 100)
+
+tile_after = logic.composer.get_tile_image(0, 0)
+assert tile_after.tobytes() != tile_before.tobytes(), "The composed tile is not changed"
+assert tile_after.getpixel((100, 56)) == (255, 0, 0), tile_after.getpixel((100, 56))
+assert logic.history_dirty_rects == [rect], logic.history_dirty_rects
+assert logic.redraw_job is not None, "The redraw is not requested"
+
+print("OK")
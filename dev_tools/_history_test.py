@@ -0,0 +1,49 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Checks of the records of the history (BhUndoHistory), which must not add the entries.
+# Run from the dev_tools folder: python _history_test.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Brushshe"))
+
+from core.bhundo import BhUndoHistory  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+image = Image.new("RGB", (600, 400), "white")
+mask = Image.new("L", image.size, 255)
+
+history = BhUndoHistory(64 * 1024 * 1024)
+history.record(image, None, None, False)
+history.record(image, [], mask, True)  # Select all.
+ImageDraw.Draw(image).rectangle((10, 10, 50, 50), fill="red")
+history.record(image, [(10, 10, 51, 51)], mask, False)
+history.undo()
+image = history.get_image().to_image()
+
+# The same selection again (select all twice): no entry, the redo is kept.
+assert history.record(image, [], mask.copy(), True) is False
+assert len(history) == 3 and history.can_redo()
+
+# Nothing is changed at all.
+assert history.record(image, [], mask, False) is False
+assert history.record(image, None, mask, False) is False
+assert len(history) == 3 and history.can_redo()
+
+# The changed selection is recorded.
+ImageDraw.Draw(mask).rectangle((0, 0, 100, 100), fill=0)
+assert history.record(image, [], mask, True) is True
+assert history.entries[-1].kind == "mask" and not history.can_redo()
+
+# The mask of the other size is not stored with the picture.
+rotated = image.rotate(90, expand=True)
+assert history.record(rotated, None, mask, False) is True
+assert history.get_mask() is None
+history.undo()
+history.redo()
+assert history.get_mask() is None and history.get_image().size == rotated.size
+
+print("OK")
@@ -0,0 +1,29 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Cost of the brush smoothing per point: BhHistory.add_point + get_smoothing_point.
+# Run from the dev_tools folder: python _smoothing_bench.py
+
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Brushshe"))
+
+from core.bhhistory import BhHistory, BhPoint  # noqa: E402
+
+points_count = 20000
+
+for factor, quality in ((3, 1), (10, 20), (32, 32), (64, 64)):
+    # Same order of the arguments as in the brush tools.
+    history = BhHistory(limit_length=factor)
+
+    t1 = time.perf_counter()
+    for i in range(points_count):
+        history.add_point(BhPoint(x=i * 0.5, y=100 + 50 * math.sin(i / 30), pressure=1.0, time=i * 8))
+        history.get_smoothing_point(factor, quality)
+    t2 = time.perf_counter()
+
+    print(f"factor {factor:2}, quality {quality:2}: {(t2 - t1) / points_count * 1e6:.2f} us per point")